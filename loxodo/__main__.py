@@ -21,6 +21,7 @@
 
 import sys
 from loxodo.config import config
+from loxodo import twofish
 
 # store base script name, taking special care if we're "frozen" using py2app or py2exe
 if hasattr(sys, "frozen") and (sys.platform != 'darwin'):
@@ -35,6 +36,8 @@ def do_cli():
 
 
 def main():
+    twofish.select_backend(config.twofish_backend)
+
     # If cmdline arguments were given, use the "cmdline" frontend.
     if len(sys.argv) > 1:
         do_cli()
@@ -23,6 +23,8 @@ import os
 import platform
 from configparser import ConfigParser as SafeConfigParser
 
+from .vault import calibrate_iterations
+
 
 class Config:
     """
@@ -38,6 +40,11 @@ class Config:
         self.reduction = False
         self.search_notes = False
         self.search_passwd = False
+        self.twofish_backend = "auto"
+        self.save_verify_full = False
+        self.stretch_iterations = 0
+        self.stretch_target_ms = 250
+        self.restretch_on_save = False
         self.alphabet = "abcdefghijklmnopqrstuvwxyz0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_"
 
         self._fname = self.get_config_filename()
@@ -72,6 +79,23 @@ class Config:
             if self._parser.get("base", "search_passwd") == "True":
                 self.search_passwd = True
 
+        if self._parser.has_option("base", "save_verify_full"):
+            if self._parser.get("base", "save_verify_full") == "True":
+                self.save_verify_full = True
+
+        if self._parser.has_option("base", "stretch_iterations"):
+            self.stretch_iterations = int(self._parser.get("base", "stretch_iterations"))
+
+        if self._parser.has_option("base", "stretch_target_ms"):
+            self.stretch_target_ms = int(self._parser.get("base", "stretch_target_ms"))
+
+        if self._parser.has_option("base", "restretch_on_save"):
+            if self._parser.get("base", "restretch_on_save") == "True":
+                self.restretch_on_save = True
+
+        if self._parser.has_option("base", "twofish_backend"):
+            self.twofish_backend = self._parser.get("base", "twofish_backend")
+
         if not os.path.exists(self._fname):
             self.save()
 
@@ -101,10 +125,31 @@ class Config:
         self._parser.set("base", "alphabetreduction", str(self.reduction))
         self._parser.set("base", "search_notes", str(self.search_notes))
         self._parser.set("base", "search_passwd", str(self.search_passwd))
+        self._parser.set("base", "save_verify_full", str(self.save_verify_full))
+        self._parser.set("base", "stretch_iterations", str(self.stretch_iterations))
+        self._parser.set("base", "stretch_target_ms", str(self.stretch_target_ms))
+        self._parser.set("base", "restretch_on_save", str(self.restretch_on_save))
+        self._parser.set("base", "twofish_backend", self.twofish_backend)
         filehandle = open(self._fname, 'w')
         self._parser.write(filehandle)
         filehandle.close()
 
+    def get_iterations(self):
+        """
+        Returns the number of key stretching iterations to use for new or re-stretched Vaults
+        """
+        if self.stretch_iterations:
+            return self.stretch_iterations
+        return calibrate_iterations(self.stretch_target_ms / 1000.0)
+
+    def get_save_iterations(self):
+        """
+        Returns the number of key stretching iterations to pass to Vault.write_to_file
+        """
+        if not self.restretch_on_save:
+            return None
+        return self.get_iterations()
+
     @staticmethod
     def get_config_filename():
         """
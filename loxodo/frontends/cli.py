@@ -42,6 +42,9 @@ from loxodo.vault import (
     Record,
 )
 from loxodo.config import config
+from loxodo.search import SearchIndex
+from loxodo import twofish
+from loxodo import keystretch
 
 
 def print_arr(*args):
@@ -55,12 +58,42 @@ def print_s(s, *args):
         print(s)
 
 
+# leading characters of a regular expression that match only themselves (ignoring case)
+_LITERAL_PREFIX = re.compile(r"[A-Za-z0-9@_-]*")
+
+
+def literal_prefix(regexp):
+    """
+    Return a string that any text matching the regular expression (case insensitive) must start with.
+    """
+    if "|" in regexp:
+        return ""
+    prefix = _LITERAL_PREFIX.match(regexp).group()
+    if regexp[len(prefix):len(prefix) + 1] in ("?", "*", "{"):
+        # the last character is optional
+        prefix = prefix[:-1]
+    return prefix
+
+
+def search_key(regexp):
+    """
+    Return a string that any text matching the regular expression (case insensitive) must contain
+    when casefolded.
+    """
+    # re.IGNORECASE lets "i" match the dotless "\u0131", which casefolds to itself
+    parts = re.split("[iI]", literal_prefix(regexp))
+    return max(parts, key=len)
+
+
 class InteractiveConsole(cmd.Cmd):
     def __init__(self):
         self.vault = None
+        self.search_index = None
         self.vault_file_name = None
         self.vault_password = None
         self.vault_modified = False
+        # ITER was set with the iter command, don't let restretch_on_save change it
+        self.iterations_pinned = False
 
         cmd.Cmd.__init__(self)
         if sys.platform == "darwin":
@@ -80,6 +113,8 @@ class InteractiveConsole(cmd.Cmd):
             raise RuntimeError("No password given") from e
         try:
             self.vault = Vault(self.vault_password, filename=self.vault_file_name)
+            self.search_index = SearchIndex(self.vault.records)
+            self.vault.add_observer(self.search_index)
             self.prompt = "[" + os.path.basename(self.vault_file_name) + "]> "
         except BadPasswordError:
             print("Bad password.")
@@ -93,6 +128,8 @@ class InteractiveConsole(cmd.Cmd):
         print("... Done.\n")
 
     def postloop(self):
+        if self.vault is not None:
+            self.vault.close()
         print()
 
     def emptyline(self):
@@ -108,7 +145,9 @@ class InteractiveConsole(cmd.Cmd):
     def do_save(self, line=None):
         'Save the vault'
         if self.vault_modified and self.vault_file_name and self.vault_password:
-            self.vault.write_to_file(self.vault_file_name, self.vault_password)
+            iterations = None if self.iterations_pinned else config.get_save_iterations()
+            self.vault.write_to_file(self.vault_file_name, self.vault_password, full_verify=config.save_verify_full,
+                                     iterations=iterations)
             self.vault_modified = False
             print("Changes Saved")
 
@@ -118,6 +157,35 @@ class InteractiveConsole(cmd.Cmd):
         """
         return True
 
+    def do_iter(self, line):
+        """
+        Show or change the number of key stretching iterations of this Vault.
+        Without an argument, the current number is shown. "auto" picks the
+        number that takes about stretch_target_ms milliseconds on this machine.
+
+        Example: iter [auto|ITERATIONS]
+        """
+        if not self.vault:
+            raise RuntimeError("No vault opened")
+
+        if not line:
+            print_s("%d iterations", self.vault.f_iter)
+            return
+
+        if line == "auto":
+            iterations = config.get_iterations()
+        else:
+            try:
+                iterations = int(line)
+            except ValueError:
+                cmd.Cmd.do_help(self, "iter")
+                return
+
+        self.vault.set_iterations(self.vault_password, iterations)
+        self.vault_modified = True
+        self.iterations_pinned = True
+        print_s("Changed to %d iterations, but not saved", self.vault.f_iter)
+
     def do_add(self, line):
         """
         Adds a user to the vault
@@ -144,7 +212,7 @@ class InteractiveConsole(cmd.Cmd):
 
         entry.passwd = passwd
 
-        self.vault.records.append(entry)
+        self.vault.add_record(entry)
         self.vault_modified = True
         print("User Added, but not saved")
 
@@ -168,7 +236,7 @@ class InteractiveConsole(cmd.Cmd):
                 entry.passwd = row[2]
                 entry.url = row[3]
                 entry.group = row[4]
-                self.vault.records.append(entry)
+                self.vault.add_record(entry)
             self.vault_modified = True
             print("Import completed, but not saved.")
         except csv.Error as e:
@@ -270,7 +338,10 @@ Username : %s""",
         "Finds titles, username, group, or combination of all 3 matching a regular expression. (Case insensitive)"
         matches = []
         pat = re.compile(regexp, re.IGNORECASE)
-        for record in self.vault.records:
+        # a match of title, username or group (the latter also in the combination) contains the key
+        key = search_key(regexp)
+        records = self.search_index.search(key) if key else self.vault.records
+        for record in records:
             if pat.match(record.title) is not None:
                 matches.append(record)
             elif pat.match(record.user) is not None:
@@ -288,8 +359,33 @@ Username : %s""",
         return matches
 
 
+def selftest():
+    """
+    Run the self-tests of password stretching and of all available Twofish backends and exit.
+    """
+    failed = False
+    try:
+        keystretch.selftest()
+        print("Password stretching: OK")
+    except RuntimeError as e:
+        print("Password stretching: FAILED (%s)" % e)
+        failed = True
+    for name in twofish.available_backends():
+        try:
+            twofish.selftest(name, force=True)
+            print("Twofish backend %s: OK" % name)
+        except RuntimeError as e:
+            print("Twofish backend %s: FAILED (%s)" % (name, e))
+            failed = True
+    print("Selected Twofish backend: " + twofish.get_backend())
+    sys.exit(1 if failed else 0)
+
+
 def main():
     args = sys.argv[1:]
+    if args == ["--selftest"]:
+        selftest()
+
     interactiveConsole = InteractiveConsole()
 
     if len(args) < 1:
@@ -19,6 +19,8 @@
 
 # pylint: disable=too-many-ancestors
 
+import threading
+
 import wx
 from wx.lib import filebrowsebutton
 
@@ -29,6 +31,14 @@ from loxodo.frontends.wx.vaultframe import VaultFrame
 from loxodo.frontends.wx import get_bitmap, get_icon
 
 
+class _OpenCancelled(Exception):
+    pass
+
+
+# part of the progress gauge covered by each stage of reading a Vault
+_GAUGE_STAGES = {"stretch": (0, 80), "decrypt": (80, 100)}
+
+
 class LoadFrame(wx.Frame):
     """
     Displays the "welcome" dialog which lets the user open a Vault.
@@ -46,6 +56,11 @@ class LoadFrame(wx.Frame):
         if config.recentvaults:
             self._fb_filename.SetHistory(config.recentvaults, 0)
         self.static_line_1 = wx.StaticLine(self.panel_1, -1)
+        self._ga_progress = wx.Gauge(self.panel_1, -1, 100)
+        self._lb_progress = wx.StaticText(self.panel_1, -1, "")
+        self._cancel_open = None
+        self._close_pending = False
+        self.Bind(wx.EVT_CLOSE, self._on_frame_close)
 
         self.SetTitle("Loxodo - " + _("Open Vault"))
 
@@ -60,16 +75,25 @@ class LoadFrame(wx.Frame):
         sizer_5.Add(self._tc_passwd, 1, wx.EXPAND|wx.ALIGN_CENTER_VERTICAL)
         sizer_3.Add(sizer_5, 0, wx.EXPAND|wx.LEFT|wx.RIGHT, 5)
 
+        sizer_6 = wx.BoxSizer(wx.HORIZONTAL)
+        sizer_6.Add(self._ga_progress, 1, wx.EXPAND|wx.ALIGN_CENTER_VERTICAL|wx.RIGHT, 5)
+        sizer_6.Add(self._lb_progress, 1, wx.ALIGN_CENTER_VERTICAL)
+        sizer_3.Add(sizer_6, 0, wx.EXPAND|wx.TOP|wx.LEFT|wx.RIGHT, 5)
+
         sizer_3.Add(self.static_line_1, 0, wx.TOP|wx.EXPAND, 10)
 
         btnsizer = wx.BoxSizer(wx.HORIZONTAL)
-        btn = wx.Button(self.panel_1, wx.ID_NEW)
-        btn.Bind(wx.EVT_BUTTON, self._on_new, id=wx.ID_NEW)
-        btnsizer.Add(btn, 0, wx.TOP | wx.RIGHT, 10)
-        btn = wx.Button(self.panel_1, wx.ID_OPEN)
-        btn.Bind(wx.EVT_BUTTON, self._on_open, id=wx.ID_OPEN)
-        btn.SetDefault()
-        btnsizer.Add(btn, 0, wx.TOP | wx.RIGHT, 10)
+        self._bt_cancel = wx.Button(self.panel_1, wx.ID_CANCEL)
+        self._bt_cancel.Bind(wx.EVT_BUTTON, self._on_cancel_open, id=wx.ID_CANCEL)
+        self._bt_cancel.Disable()
+        btnsizer.Add(self._bt_cancel, 0, wx.TOP | wx.RIGHT, 10)
+        self._bt_new = wx.Button(self.panel_1, wx.ID_NEW)
+        self._bt_new.Bind(wx.EVT_BUTTON, self._on_new, id=wx.ID_NEW)
+        btnsizer.Add(self._bt_new, 0, wx.TOP | wx.RIGHT, 10)
+        self._bt_open = wx.Button(self.panel_1, wx.ID_OPEN)
+        self._bt_open.Bind(wx.EVT_BUTTON, self._on_open, id=wx.ID_OPEN)
+        self._bt_open.SetDefault()
+        btnsizer.Add(self._bt_open, 0, wx.TOP | wx.RIGHT, 10)
         sizer_3.Add(btnsizer, 0, wx.ALIGN_RIGHT | wx.BOTTOM, 5)
 
         self.panel_1.SetSizer(sizer_3)
@@ -95,7 +119,7 @@ class LoadFrame(wx.Frame):
         filename = dialog.GetPath()
         dialog.Destroy()
 
-        Vault.create(password, filename=filename)
+        Vault.create(password, filename=filename, iterations=config.get_iterations())
         self._fb_filename.SetValue(filename)
 
         dial = wx.MessageDialog(self,
@@ -108,18 +132,101 @@ class LoadFrame(wx.Frame):
         self._tc_passwd.SetFocus()
         self._tc_passwd.SelectAll()
 
+    def _set_busy(self, busy):
+        """
+        Lock the dialog while a Vault is being read, or unlock it again.
+        """
+        self._tc_passwd.Enable(not busy)
+        self._fb_filename.Enable(not busy)
+        self._bt_new.Enable(not busy)
+        self._bt_open.Enable(not busy)
+        self._bt_cancel.Enable(busy)
+        self._ga_progress.SetValue(0)
+        self._lb_progress.SetLabel("")
+
     def _on_open(self, dummy):
+        if self._cancel_open is not None:
+            return
+        password = self._tc_passwd.GetValue().encode('latin1', 'replace')
+        filename = self._fb_filename.GetValue()
+        self._cancel_open = threading.Event()
+        self._set_busy(True)
+        thread = threading.Thread(target=self._read_vault, args=(filename, password, self._cancel_open))
+        thread.daemon = True
+        thread.start()
+
+    def _read_vault(self, filename, password, cancel):
+        """
+        Read a Vault, running on a worker thread and reporting back via wx.CallAfter.
+        """
+        shown = [None]
+
+        def progress(stage, done, total):
+            if cancel.is_set():
+                raise _OpenCancelled()
+            if stage == "records":
+                state = (100, _("Reading records") + " (%d)" % done)
+            elif stage == "stretch":
+                (start, end) = _GAUGE_STAGES[stage]
+                state = (start + (end - start) * done // total, _("Checking password"))
+            else:
+                (start, end) = _GAUGE_STAGES[stage]
+                state = (start + (end - start) * done // total, _("Decrypting"))
+            # only bother the GUI thread when something visible changes
+            if state != shown[0]:
+                shown[0] = state
+                wx.CallAfter(self._on_open_progress, *state)
+
         try:
-            password = self._tc_passwd.GetValue().encode('latin1', 'replace')
+            vault = Vault(password, filename=filename, progress=progress)
+        except _OpenCancelled:
+            wx.CallAfter(self._on_open_done, filename, password, None, None)
+        except Exception as e: # pylint: disable=broad-except
+            wx.CallAfter(self._on_open_done, filename, password, None, e)
+        else:
+            wx.CallAfter(self._on_open_done, filename, password, vault, None)
+
+    def _on_open_progress(self, value, text):
+        if self._cancel_open is None:
+            return
+        self._ga_progress.SetValue(value)
+        self._lb_progress.SetLabel(text)
+
+    def _on_cancel_open(self, dummy):
+        if self._cancel_open is not None:
+            self._cancel_open.set()
+            self._lb_progress.SetLabel(_("Cancelling..."))
+
+    def _on_frame_close(self, evt):
+        if self._cancel_open is None:
+            evt.Skip()
+            return
+        # let the worker thread finish before going away
+        self._cancel_open.set()
+        self._close_pending = True
+        self.Hide()
+
+    def _on_open_done(self, filename, password, vault, error):
+        """
+        Called on the GUI thread once reading the Vault has finished, failed or was cancelled.
+        """
+        self._cancel_open = None
+        if self._close_pending:
+            if vault is not None:
+                vault.close()
+            self.Destroy()
+            return
+        self._set_busy(False)
+
+        if vault is not None:
             vaultframe = VaultFrame(None, -1, "")
-            vaultframe.open_vault(self._fb_filename.GetValue(), password)
-            config.recentvaults.insert(0, self._fb_filename.GetValue())
+            vaultframe.open_vault(filename, password, vault)
+            config.recentvaults.insert(0, filename)
             config.save()
             self.Hide()
             vaultframe.Show()
             self.Destroy()
-        except BadPasswordError:
-            vaultframe.Destroy()
+        elif isinstance(error, BadPasswordError):
             dial = wx.MessageDialog(self,
                                     _('The given password does not match the Vault'),
                                     _('Bad Password'),
@@ -129,8 +236,7 @@ class LoadFrame(wx.Frame):
             dial.Destroy()
             self._tc_passwd.SetFocus()
             self._tc_passwd.SelectAll()
-        except VaultVersionError:
-            vaultframe.Destroy()
+        elif isinstance(error, VaultVersionError):
             dial = wx.MessageDialog(self,
                                     _('This is not a PasswordSafe V3 Vault'),
                                     _('Bad Vault'),
@@ -138,8 +244,7 @@ class LoadFrame(wx.Frame):
                                     )
             dial.ShowModal()
             dial.Destroy()
-        except VaultFormatError:
-            vaultframe.Destroy()
+        elif isinstance(error, VaultFormatError):
             dial = wx.MessageDialog(self,
                                     _('Vault integrity check failed'),
                                     _('Bad Vault'),
@@ -147,3 +252,5 @@ class LoadFrame(wx.Frame):
                                     )
             dial.ShowModal()
             dial.Destroy()
+        elif error is not None:
+            raise error
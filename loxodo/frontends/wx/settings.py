@@ -53,6 +53,12 @@ class Settings(wx.Dialog):
 
         self._tc_alphabet = self._add_a_textcontrol(_sz_fields,_("Alphabet")+ ":",config.alphabet)
 
+        self._save_verify_full = self._add_a_checkbox(_sz_fields,_("Re-open Vault to verify each save") + ":")
+
+        self._sc_iterations = self._add_a_spincontrol(_sz_fields, _("Key stretching iterations (0: auto)") + ":",0,2**31-1)
+        self._sc_target_ms = self._add_a_spincontrol(_sz_fields, _("Auto: unlock time in ms") + ":",10,10000)
+        self._cb_restretch = self._add_a_checkbox(_sz_fields,_("Re-stretch Vault password on save") + ":")
+
         _sz_fields.AddGrowableCol(1)
 
         _ln_line = wx.StaticLine(self.panel, -1, size=(20, -1), style=wx.LI_HORIZONTAL)
@@ -123,6 +129,10 @@ class Settings(wx.Dialog):
         self._cb_reduction.SetValue(config.reduction)
         self._search_notes.SetValue(config.search_notes)
         self._search_passwd.SetValue(config.search_passwd)
+        self._save_verify_full.SetValue(config.save_verify_full)
+        self._sc_iterations.SetValue(config.stretch_iterations)
+        self._sc_target_ms.SetValue(config.stretch_target_ms)
+        self._cb_restretch.SetValue(config.restretch_on_save)
 
     def _apply_changes(self, dummy):
         """
@@ -132,6 +142,10 @@ class Settings(wx.Dialog):
         config.reduction = self._cb_reduction.GetValue()
         config.search_notes = self._search_notes.GetValue()
         config.search_passwd = self._search_passwd.GetValue()
+        config.save_verify_full = self._save_verify_full.GetValue()
+        config.stretch_iterations = self._sc_iterations.GetValue()
+        config.stretch_target_ms = self._sc_target_ms.GetValue()
+        config.restretch_on_save = self._cb_restretch.GetValue()
         config.alphabet = self._tc_alphabet.GetValue()
         config.save()
 
@@ -24,6 +24,8 @@
 import os
 import csv
 import binascii
+import threading
+import time
 import webbrowser
 from datetime import datetime
 
@@ -35,6 +37,8 @@ from loxodo import __version__
 from loxodo.vault import (
     Vault, BadPasswordError, VaultFormatError, VaultVersionError, Record, duplicate_record)
 from loxodo.config import config
+from loxodo.search import SearchIndex
+from loxodo.sorting import SortIndex
 from loxodo.frontends.wx.recordframe import RecordFrame
 from loxodo.frontends.wx.mergeframe import MergeFrame
 from loxodo.frontends.wx.settings import Settings
@@ -46,6 +50,26 @@ try:
 except ImportError:
     mintotp = None
 
+# save this long after the last change, but at most this long after the first unsaved one
+_SAVE_DELAY_MS = 500
+_SAVE_MAX_DELAY_MS = 5000
+
+# filter this long after the last keystroke in the search box
+_SEARCH_DELAY_MS = 150
+# seconds of filtering between two looks at pending GUI events, and records checked in one go
+_FILTER_SLICE = 0.02
+_FILTER_CHUNK = 1000
+
+# list column -> columns of loxodo.sorting.COLUMNS to sort by, most significant first
+_SORT_KEYS = (
+    ("title", "group", "user"),
+    ("user", "title", "group"),
+    ("group", "title", "user"),
+    ("last_mod", "title", "group"),
+)
+# list columns sorted in descending order (newest first) on the first click
+_SORT_DESCENDING_FIRST = (3,)
+
 class VaultFrame(wx.Frame):
     """
     Displays (and lets the user edit) the Vault.
@@ -57,7 +81,13 @@ class VaultFrame(wx.Frame):
         def __init__(self, *args, **kwds):
             wx.ListCtrl.__init__(self, *args, **kwds)
             self.vault = None
+            self._search = None
             self._filterstring = ""
+            self._filter_job = None
+            # columns -> SortIndex, built on first use
+            self._sort_indexes = {}
+            self.sort_columns = _SORT_KEYS[2]
+            self.sort_reverse = False
             self.displayed_entries = []
             self.InsertColumn(0, _("Title"))
             self.InsertColumn(1, _("Username"))
@@ -67,7 +97,6 @@ class VaultFrame(wx.Frame):
             self.SetColumnWidth(1, 128)
             self.SetColumnWidth(2, 180)
             self.SetColumnWidth(3, 128)
-            self.sort_function = lambda e1: e1.group.lower()
             self.update_fields()
 
         def OnGetItemText(self, item, col):
@@ -100,51 +129,137 @@ class VaultFrame(wx.Frame):
 
             Extends the base classes' method.
             """
+            # anything still filtering in the background is out of date now
+            self._filter_job = None
             if not self.vault:
                 self.displayed_entries = []
                 return
-            self.displayed_entries = [record for record in self.vault.records if self.filter_record(record)]
+            self._show(self._run_filter(self._filter()))
+
+        def _filter(self):
+            """
+            Generator computing the sorted list of entries to display (its return value).
 
-            self.displayed_entries.sort(key=self.sort_function)
+            Yields whenever it may be interrupted.
+            """
+            filterstring = self._filterstring
+            if self._search.include_notes != config.search_notes:
+                self._build_search_index()
+            entries = self._search.search(filterstring)
+            if config.search_passwd and filterstring:
+                found = set(entries)
+                records = list(self.vault.records)
+                for i in range(0, len(records), _FILTER_CHUNK):
+                    yield
+                    entries.extend(record for record in records[i:i + _FILTER_CHUNK]
+                                   if record not in found and filterstring in record.passwd)
+            yield
+            return self._sort_index().sort(entries, self.sort_reverse)
+
+        @staticmethod
+        def _run_filter(job, deadline=None):
+            """
+            Run a _filter() job until it is done and return its result, or return None once deadline
+            (in terms of time.monotonic()) has passed.
+            """
+            try:
+                while True:
+                    next(job)
+                    if deadline is not None and time.monotonic() > deadline:
+                        return None
+            except StopIteration as e:
+                return e.value
+
+        def _show(self, entries):
+            self.displayed_entries = entries
             self.SetItemCount(len(self.displayed_entries))
             wx.ListCtrl.Refresh(self)
 
-        def filter_record(self,record):
-            if record.title.lower().find(self._filterstring.lower()) >= 0:
-               return True
-
-            if record.group.lower().find(self._filterstring.lower()) >= 0:
-               return True
-
-            if record.user.lower().find(self._filterstring.lower()) >= 0:
-               return True
-
-            if config.search_notes:
-             if record.notes.lower().find(self._filterstring.lower()) >= 0:
-                return True
-
-            if config.search_passwd:
-             if record.passwd.find(self._filterstring) >= 0:
-                return True
+        def _build_search_index(self):
+            """
+            (Re-)build the search index of the Vault, which then keeps itself up to date.
+            """
+            if self._search is not None:
+                self.vault.remove_observer(self._search)
+            self._search = SearchIndex(self.vault.records, config.search_notes)
+            self.vault.add_observer(self._search)
 
-            return False
+        def _sort_index(self):
+            """
+            Return the SortIndex of the current sort columns, which keeps itself up to date.
+            """
+            sort_index = self._sort_indexes.get(self.sort_columns)
+            if sort_index is None:
+                sort_index = SortIndex(self.vault.records, self.sort_columns)
+                self.vault.add_observer(sort_index)
+                self._sort_indexes[self.sort_columns] = sort_index
+            return sort_index
+
+        def set_sort(self, columns, reverse=False):
+            """
+            Sort the displayed entries by the given columns of loxodo.sorting.COLUMNS, the first one
+            in descending order if reverse is set.
+            """
+            self.sort_columns = tuple(columns)
+            self.sort_reverse = reverse
+            self.update_fields()
 
         def set_vault(self, vault):
             """
             Set the Vault this control should display.
             """
+            if self.vault:
+                for observer in [self._search] + list(self._sort_indexes.values()):
+                    if observer is not None:
+                        self.vault.remove_observer(observer)
+            self._search = None
+            self._sort_indexes = {}
             self.vault = vault
+            if vault:
+                self._build_search_index()
             self.update_fields()
             self.select_first()
 
         def set_filter(self, filterstring):
             """
             Sets a filter string to limit the displayed entries
+
+            Filtering runs in slices in between GUI events; a newer filter or update_fields()
+            cancels it.
             """
             self._filterstring = filterstring
-            self.update_fields()
+            if not self.vault:
+                self.update_fields()
+                self.select_first()
+                return
+            self._filter_job = self._filter()
+            self._continue_filter(self._filter_job)
+
+        def _continue_filter(self, job):
+            """
+            Run a slice of a filter job, and schedule the next one if it is not done yet.
+            """
+            if not self or job is not self._filter_job:
+                # control destroyed or filter superseded
+                return
+            entries = self._run_filter(job, time.monotonic() + _FILTER_SLICE)
+            if entries is None:
+                wx.CallAfter(self._continue_filter, job)
+                return
+            self._filter_job = None
+            self._show(entries)
             self.select_first()
 
+        def flush_filter(self):
+            """
+            Finish filtering in the foreground, if a filter is running.
+            """
+            job = self._filter_job
+            if job is not None:
+                self._filter_job = None
+                self._show(self._run_filter(job))
+                self.select_first()
+
         def deselect_all(self):
             """
             De-selects all items
@@ -280,6 +395,13 @@ class VaultFrame(wx.Frame):
         self.vault_password = None
         self.vault = None
         self._is_modified = False
+        self._save_timer = None
+        self._save_first_change = None
+        self._save_thread = None
+        self._save_again = False
+        self._save_failed = False
+        self._close_pending = False
+        self._search_timer = None
 
     def _on_list_box_char(self, key_event):
         """
@@ -301,33 +423,73 @@ class VaultFrame(wx.Frame):
     def mark_modified(self):
         self._is_modified = True
         if ((self.vault_file_name is not None) and (self.vault_password is not None)):
-            self.save_vault(self.vault_file_name, self.vault_password)
+            self._schedule_save()
         self.list.update_fields()
 
-    def open_vault(self, filename, password):
+    def _schedule_save(self):
         """
-        Set the Vault that this frame should display.
+        Save the Vault in the background once changes stop coming in, coalescing bursts of edits.
         """
-        self.vault_file_name = None
-        self.vault_password = None
+        now = time.monotonic()
+        if self._save_first_change is None:
+            self._save_first_change = now
+        deadline = _SAVE_MAX_DELAY_MS - int((now - self._save_first_change) * 1000)
+        delay = max(0, min(_SAVE_DELAY_MS, deadline))
+        if self._save_timer is None:
+            self._save_timer = wx.CallLater(delay, self._start_save)
+        else:
+            self._save_timer.Start(delay)
+
+    def _start_save(self):
+        """
+        Write a snapshot of the Vault to disk on a worker thread.
+        """
+        if self._save_thread is not None:
+            # one save at a time; pick up the latest changes once this one is done
+            self._save_again = True
+            return
+        self._save_first_change = None
         self._is_modified = False
-        self.vault = Vault(password, filename=filename)
-        self.list.set_vault(self.vault)
-        self.vault_file_name = filename
-        self.vault_password = password
-        self.statusbar.SetStatusText(_("Read Vault contents from disk"), 0)
+        snapshot = self.vault.snapshot()
+        self._save_thread = threading.Thread(target=self._write_snapshot,
+                                             args=(snapshot, self.vault_file_name, self.vault_password,
+                                                   config.save_verify_full))
+        self._save_thread.daemon = True
+        self._save_thread.start()
+        self.statusbar.SetStatusText(_("Writing Vault contents to disk..."), 0)
 
-    def save_vault(self, filename, password):
+    def _write_snapshot(self, snapshot, filename, password, full_verify):
         """
-        Write Vault contents to disk.
+        Runs on the save worker thread, reporting back via wx.CallAfter.
         """
         try:
-            self._is_modified = False
-            self.vault_file_name = filename
-            self.vault_password = password
-            self.vault.write_to_file(filename, password)
+            snapshot.write_to_file(filename, password, full_verify=full_verify,
+                                   iterations=config.get_save_iterations())
+        except Exception as e: # pylint: disable=broad-except
+            wx.CallAfter(self._on_save_done, snapshot, e)
+        else:
+            wx.CallAfter(self._on_save_done, snapshot, None)
+
+    def _on_save_done(self, snapshot, error):
+        """
+        Called on the GUI thread once a background save has finished or failed.
+        """
+        self._save_thread = None
+        if error is None:
+            try:
+                self.vault.sync_saved(snapshot)
+            except Exception as e: # pylint: disable=broad-except
+                error = e
+        self._save_failed = error is not None
+        if error is None:
             self.statusbar.SetStatusText(_("Wrote Vault contents to disk"), 0)
-        except RuntimeError:
+        else:
+            self._is_modified = True
+            if self._close_pending:
+                # keep the frame (and the unsaved changes) around, the user may want to retry
+                self._close_pending = False
+                self.Show()
+            self.statusbar.SetStatusText(_("Could not write Vault contents to disk"), 0)
             dial = wx.MessageDialog(self,
                                     _("Could not write Vault contents to disk"),
                                     _("Error writing to disk"),
@@ -336,6 +498,30 @@ class VaultFrame(wx.Frame):
             dial.ShowModal()
             dial.Destroy()
 
+        if self._save_again:
+            self._save_again = False
+            self._start_save()
+        elif self._close_pending:
+            self.vault.close()
+            self.Destroy()
+
+    def open_vault(self, filename, password, vault=None):
+        """
+        Set the Vault that this frame should display, reading it from disk unless already given.
+        """
+        self.vault_file_name = None
+        self.vault_password = None
+        self._is_modified = False
+        if vault is None:
+            vault = Vault(password, filename=filename)
+        if self.vault is not None:
+            self.vault.close()
+        self.vault = vault
+        self.list.set_vault(self.vault)
+        self.vault_file_name = filename
+        self.vault_password = password
+        self.statusbar.SetStatusText(_("Read Vault contents from disk"), 0)
+
     def _clear_clipboard(self, match_text = None):
         if match_text:
             if not wx.TheClipboard.Open():
@@ -369,20 +555,35 @@ class VaultFrame(wx.Frame):
         self.list.deselect_all()
         self.list.Select(index, True)
         self.list.Focus(index)
-        self._on_copy_password(None)
+        # the entry clicked on, even if a search would change the list
+        self._copy_password(self.list.displayed_entries[index])
+
+    def _get_selected_entry(self):
+        """
+        Return the Record selected in the list (or None), after bringing the list up to date
+        with the search field.
+        """
+        self._flush_search()
+        index = self.list.GetFirstSelected()
+        if index == -1:
+            return None
+        return self.list.displayed_entries[index]
 
     def _on_list_column_click(self, event):
         """
         Event handler: Fires when user clicks on the list header.
         """
         col = event.GetColumn()
-        if col == 0:
-            self.list.sort_function = lambda e1: e1.title.lower()
-        if col == 1:
-            self.list.sort_function = lambda e1: e1.user.lower()
-        if col == 2:
-            self.list.sort_function = lambda e1: e1.group.lower()
-        self.list.update_fields()
+        if not 0 <= col < len(_SORT_KEYS):
+            return
+        if self.list.sort_columns == _SORT_KEYS[col]:
+            # clicking the sort column again toggles the direction
+            reverse = not self.list.sort_reverse
+        else:
+            reverse = col in _SORT_DESCENDING_FIRST
+        self.list.set_sort(_SORT_KEYS[col], reverse)
+        if hasattr(self.list, "ShowSortIndicator"):
+            self.list.ShowSortIndicator(col, not reverse)
 
     def _on_list_contextmenu(self, dummy):
         self.PopupMenu(self._recordmenu)
@@ -536,11 +737,7 @@ if not, write to the Free Software Foundation, Inc.,
         oldrecord_newrecord_reason_pairs = []  # list of (oldrecord, newrecord, reason) tuples to merge
         for record in merge_vault.records:
             # check if corresponding record exists in current Vault
-            my_record = None
-            for record2 in self.vault.records:
-                if record2.is_corresponding(record):
-                    my_record = record2
-                    break
+            my_record = self.vault.find_corresponding(record)
 
             # record is new
             if not my_record:
@@ -563,7 +760,7 @@ if not, write to the Free Software Foundation, Inc.,
             if oldrecord:
                 oldrecord.merge(newrecord)
             else:
-                self.vault.records.append(newrecord)
+                self.vault.add_record(newrecord)
         self.mark_modified()
 
     def _on_exit(self, dummy):
@@ -576,10 +773,9 @@ if not, write to the Free Software Foundation, Inc.,
         """
         Event handler: Fires when user chooses this menu item.
         """
-        index = self.list.GetFirstSelected()
-        if index is None:
+        entry = self._get_selected_entry()
+        if entry is None:
             return
-        entry = self.list.displayed_entries[index]
 
         with RecordFrame(self) as recordframe:
             recordframe.vault_record = entry
@@ -595,31 +791,29 @@ if not, write to the Free Software Foundation, Inc.,
         recordframe = RecordFrame(self)
         recordframe.vault_record = entry
         if recordframe.ShowModal() != wx.ID_CANCEL:
-            self.vault.records.append(entry)
+            self.vault.add_record(entry)
             self.mark_modified()
         recordframe.Destroy()
 
     def _on_add_duplicate(self, dummy):
-        index = self.list.GetFirstSelected()
-        if index is None:
+        entry2 = self._get_selected_entry()
+        if entry2 is None:
             return
-        entry2 = self.list.displayed_entries[index]
         entry = duplicate_record(entry2)
 
         with RecordFrame(self) as recordframe:
             recordframe.vault_record = entry
             if recordframe.ShowModal() == wx.ID_OK:
-                self.vault.records.append(entry)
+                self.vault.add_record(entry)
                 self.mark_modified()
 
     def _on_delete(self, dummy):
         """
         Event handler: Fires when user chooses this menu item.
         """
-        index = self.list.GetFirstSelected()
-        if index == -1:
+        entry = self._get_selected_entry()
+        if entry is None:
             return
-        entry = self.list.displayed_entries[index]
 
         if ((entry.user != "") or (entry.passwd != "")):
             dial = wx.MessageDialog(self,
@@ -632,17 +826,16 @@ if not, write to the Free Software Foundation, Inc.,
             if retval != wx.ID_YES:
                 return
 
-        self.vault.records.remove(entry)
+        self.vault.remove_record(entry)
         self.mark_modified()
 
     def _on_copy_username(self, dummy):
         """
         Event handler: Fires when user chooses this menu item.
         """
-        index = self.list.GetFirstSelected()
-        if index == -1:
+        entry = self._get_selected_entry()
+        if entry is None:
             return
-        entry = self.list.displayed_entries[index]
         try:
             self._copy_to_clipboard(entry.user)
             self.statusbar.SetStatusText(_('Copied username of "%s" to clipboard') % entry.title, 0)
@@ -653,10 +846,15 @@ if not, write to the Free Software Foundation, Inc.,
         """
         Event handler: Fires when user chooses this menu item.
         """
-        index = self.list.GetFirstSelected()
-        if index == -1:
+        entry = self._get_selected_entry()
+        if entry is None:
             return
-        entry = self.list.displayed_entries[index]
+        self._copy_password(entry)
+
+    def _copy_password(self, entry):
+        """
+        Copy the password of the given Record to the clipboard for a few seconds.
+        """
         try:
             self._copy_to_clipboard(entry.passwd, duration=10)
             self.statusbar.SetStatusText(_('Copied password of "%s" to clipboard') % entry.title, 0)
@@ -665,10 +863,9 @@ if not, write to the Free Software Foundation, Inc.,
 
     def _on_totp(self, dummy):
         if mintotp:
-            index = self.list.GetFirstSelected()
-            if index == -1:
+            entry = self._get_selected_entry()
+            if entry is None:
                 return
-            entry = self.list.displayed_entries[index]
             try:
                 self._copy_to_clipboard(mintotp.totp(entry.passwd), duration=10)
                 self.statusbar.SetStatusText(_('Copied TOTP of "%s" to clipboard') % entry.title, 0)
@@ -679,10 +876,9 @@ if not, write to the Free Software Foundation, Inc.,
         """
         Event handler: Fires when user chooses this menu item.
         """
-        index = self.list.GetFirstSelected()
-        if index == -1:
+        entry = self._get_selected_entry()
+        if entry is None:
             return
-        entry = self.list.displayed_entries[index]
         try:
             webbrowser.open(entry.url)
         except ImportError:
@@ -699,8 +895,27 @@ if not, write to the Free Software Foundation, Inc.,
         """
         Event handler: Fires when user interacts with search field
         """
+        # wait for the user to stop typing
+        if self._search_timer is None:
+            self._search_timer = wx.CallLater(_SEARCH_DELAY_MS, self._search_now)
+        else:
+            self._search_timer.Start(_SEARCH_DELAY_MS)
+
+    def _search_now(self):
+        """
+        Apply the contents of the search field to the list
+        """
         self.list.set_filter(self._searchbox.GetValue())
 
+    def _flush_search(self):
+        """
+        Make sure the list reflects the contents of the search field
+        """
+        if self._search_timer is not None and self._search_timer.IsRunning():
+            self._search_timer.Stop()
+            self._search_now()
+        self.list.flush_filter()
+
     def _on_search_cancel(self, dummy):
         """
         Event handler: Fires when user interacts with search field
@@ -711,6 +926,29 @@ if not, write to the Free Software Foundation, Inc.,
         """
         Event handler: Fires when user closes the frame
         """
+        if self._search_timer is not None:
+            self._search_timer.Stop()
+        if self._save_timer is not None and self._save_timer.IsRunning():
+            self._save_timer.Stop()
+            self._start_save()
+        elif self._save_failed and self._is_modified and self._save_thread is None:
+            dial = wx.MessageDialog(self,
+                                    _("Could not write Vault contents to disk. Discard the unsaved changes and close anyway?"),
+                                    _("Error writing to disk"),
+                                    wx.YES_NO | wx.NO_DEFAULT | wx.ICON_WARNING
+                                    )
+            retval = dial.ShowModal()
+            dial.Destroy()
+            if retval != wx.ID_YES:
+                # try again, closing once that worked
+                self._start_save()
+        if self._save_thread is not None:
+            # finish writing before going away, see _on_save_done
+            self._close_pending = True
+            self.Hide()
+            return
+        if self.vault is not None:
+            self.vault.close()
         self.Destroy()
 
     def _on_searchbox_char(self, evt):
@@ -730,6 +968,8 @@ if not, write to the Free Software Foundation, Inc.,
 
         # If "Up" or "Down" was pressed, ignore key and focus self.list
         if keycode in (wx.WXK_UP, wx.WXK_DOWN):
+            # a filter finishing later would reset the selection being moved
+            self._flush_search()
             self.list.SetFocus()
             return
         if evt.GetModifiers() == wx.MOD_CONTROL and keycode == wx.WXK_CONTROL_U:
@@ -0,0 +1,92 @@
+#
+# Loxodo -- Password Safe V3 compatible Password Vault
+# Copyright (C) 2008 Christoph Sommer <mail@christoph-sommer.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+Password stretching as used by PasswordSafe V3: P' = SHA-256 applied ITER
+times to SHA-256(password + SALT).
+
+With ITER in the hundreds of thousands, the iteration loop is the whole cost
+of opening a Vault, so it keeps the per-round work of the interpreter down to
+a single call of the hash constructor and its digest() method.
+"""
+
+import hashlib
+from itertools import repeat
+
+
+def _iterate(digest, iterations):
+    """
+    Apply SHA-256 to digest the given number of times.
+    """
+    new = hashlib.sha256
+    # eight rounds per pass through the loop
+    for dummy in repeat(None, iterations >> 3):
+        digest = new(new(new(new(new(new(new(new(
+            digest).digest()).digest()).digest()).digest()).digest()).digest()).digest()).digest()
+    for dummy in repeat(None, iterations & 7):
+        digest = new(digest).digest()
+    return digest
+
+
+# rounds between two calls of the progress callback
+_PROGRESS_ROUNDS = 1 << 15
+
+
+def stretch_password(password, salt, iterations, progress=None):
+    """
+    Generate the SHA-256 value of a password after several rounds of stretching.
+
+    The algorithm is described in the following paper:
+    [KEYSTRETCH Section 4.1] http://www.schneier.com/paper-low-entropy.pdf
+
+    If given, progress(rounds_done, iterations) is called every few thousand rounds.
+    """
+    sha = hashlib.sha256()
+    sha.update(password)
+    sha.update(salt)
+    if progress is None:
+        return _iterate(sha.digest(), iterations)
+
+    digest = sha.digest()
+    for done in range(0, iterations, _PROGRESS_ROUNDS):
+        digest = _iterate(digest, min(_PROGRESS_ROUNDS, iterations - done))
+        progress(min(done + _PROGRESS_ROUNDS, iterations), iterations)
+    return digest
+
+
+# known-answer tests: (password, salt, iterations, stretched password)
+_KNOWN_ANSWERS = (
+    (b"Now Testing Crypto-Functions....", b"\x00" * 16 + b"\x01" * 16, 2048,
+     "9da71ed7c6a56a203e79e8a560276ecdede0df767d372952e7f7f7abe0ad5174"),
+    (b"", bytes(32), 1,
+     "2b32db6c2c0a6235fb1397e8225ea85e0f0e6e8c7b126d0016ccbde0e667151e"),
+    (b"secret", b"salt" * 8, 0,
+     "ecb594caeac5db7359f71fecb29b00307e9c9195cd44ec7953d484e867c14844"),
+    (b"secret", b"salt" * 8, 2063,
+     "c38c89974a4b5a670916c4e42555e485d1bc99a0a0425ccdbee9771f9e1f2032"),
+)
+
+
+def selftest():
+    """
+    Check stretch_password() against known answers and raise RuntimeError on failure.
+    """
+    for (password, salt, iterations, stretched_password) in _KNOWN_ANSWERS:
+        if stretch_password(password, salt, iterations).hex() != stretched_password:
+            raise RuntimeError("Password stretching failed known-answer test")
@@ -0,0 +1,223 @@
+#
+# Loxodo -- Password Safe V3 compatible Password Vault
+# Copyright (C) 2008 Christoph Sommer <mail@christoph-sommer.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+Case insensitive substring search over the Records of a Vault.
+
+A SearchIndex keeps the casefolded text of the searched fields of each Record
+and an inverted index from each trigram (sequence of three characters) of
+these texts to the ordinals of the Records containing it.  A query of three
+or more characters is looked up by intersecting the posting lists of its
+trigrams and confirming the few candidates against their texts, so its cost
+depends on the number of matches rather than on the size of the Vault.
+Registered as an observer of the Vault, the index follows all changes of its
+Records.
+
+Search-as-you-type mostly extends or shortens the previous query, so the
+results of the last few queries are kept: a longer query only needs to be
+checked against the Records matching a shorter one contained in it.
+"""
+
+from array import array
+from bisect import bisect_left
+
+# searched fields: title, group, user
+_FIELDS = (0x03, 0x02, 0x04)
+_NOTES = 0x05
+
+# joins the fields of a Record, so a query cannot match across two of them
+_SEPARATOR = "\0"
+
+# length of the indexed substrings
+_GRAM = 3
+
+# number of earlier queries whose results are kept
+_STACK_SIZE = 32
+
+
+def _grams(text):
+    """
+    Return the set of trigrams of a text that do not span two fields.
+    """
+    grams = set()
+    for part in text.split(_SEPARATOR):
+        grams.update(part[i:i+_GRAM] for i in range(len(part) - _GRAM + 1))
+    return grams
+
+
+class SearchIndex:
+    """
+    Casefolded title, group, user (and, optionally, notes) of a number of Records, indexed by trigram.
+
+    Each Record gets an ordinal when added, in order of insertion.  Posting lists are sorted
+    arrays of ordinals; entries of removed Records and of trigrams a Record lost by an update
+    are left in place (candidates are confirmed anyway) until they make up half of the index,
+    which is then rebuilt.
+    """
+    def __init__(self, records=(), include_notes=False):
+        self.include_notes = include_notes
+        self._fields = _FIELDS + (_NOTES,) if include_notes else _FIELDS
+        self._texts = {}
+        self._ordinals = {}
+        self._records = []
+        self._postings = {}
+        self._entries = 0
+        self._stale = 0
+        # (casefolded query, matching Records), each query containing the one before
+        self._stack = []
+        for record in records:
+            self.add(record)
+
+    def __len__(self):
+        return len(self._texts)
+
+    def _text(self, record):
+        fields = [record.title, record.group, record.user]
+        if self.include_notes:
+            fields.append(record.notes)
+        return _SEPARATOR.join(fields).casefold()
+
+    def _post(self, grams, ordinal):
+        """
+        Add ordinal to the posting lists of the given trigrams.
+        """
+        postings = self._postings
+        for gram in grams:
+            posting = postings.get(gram)
+            if posting is None:
+                postings[gram] = array("I", (ordinal,))
+            elif posting[-1] < ordinal:
+                posting.append(ordinal)
+            else:
+                i = bisect_left(posting, ordinal)
+                if i < len(posting) and posting[i] == ordinal:
+                    continue
+                posting.insert(i, ordinal)
+            self._entries += 1
+
+    def _rebuild(self):
+        """
+        Renumber all Records and rebuild the posting lists without stale entries.
+        """
+        texts = self._texts
+        self._ordinals = {}
+        self._records = []
+        self._postings = {}
+        self._entries = 0
+        self._stale = 0
+        for (ordinal, (record, text)) in enumerate(texts.items()):
+            self._ordinals[record] = ordinal
+            self._records.append(record)
+            self._post(_grams(text), ordinal)
+
+    def _collect_garbage(self):
+        if self._stale * 2 > self._entries:
+            self._rebuild()
+
+    def add(self, record):
+        """
+        Add a Record to the index, or update its entry.
+        """
+        text = self._text(record)
+        old_text = self._texts.get(record)
+        if old_text == text:
+            return
+        self._stack.clear()
+        self._texts[record] = text
+        if old_text is None:
+            ordinal = len(self._records)
+            self._ordinals[record] = ordinal
+            self._records.append(record)
+            self._post(_grams(text), ordinal)
+            return
+        grams = _grams(text)
+        old_grams = _grams(old_text)
+        self._stale += len(old_grams - grams)
+        self._post(grams - old_grams, self._ordinals[record])
+        self._collect_garbage()
+
+    def remove(self, record):
+        """
+        Remove a Record from the index.
+        """
+        text = self._texts.pop(record, None)
+        if text is None:
+            return
+        self._stack.clear()
+        self._records[self._ordinals.pop(record)] = None
+        self._stale += len(_grams(text))
+        self._collect_garbage()
+
+    def record_added(self, record):
+        self.add(record)
+
+    def record_removed(self, record):
+        self.remove(record)
+
+    def field_changed(self, record, raw_type):
+        if raw_type in self._fields and record in self._texts:
+            self.add(record)
+
+    def _lookup(self, query):
+        """
+        Return the Records containing a casefolded query of at least _GRAM characters, using the posting lists.
+        """
+        postings = []
+        for gram in _grams(query):
+            posting = self._postings.get(gram)
+            if posting is None:
+                return []
+            postings.append(posting)
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            if len(candidates) <= 1:
+                break
+            candidates.intersection_update(posting)
+
+        records = self._records
+        texts = self._texts
+        results = []
+        for ordinal in sorted(candidates):
+            record = records[ordinal]
+            if record is not None and query in texts[record]:
+                results.append(record)
+        return results
+
+    def search(self, query):
+        """
+        Return the list of Records (in order of insertion) containing the query in one of their searched fields.
+        """
+        query = query.casefold()
+        stack = self._stack
+        while stack and stack[-1][0] not in query:
+            stack.pop()
+        if stack and stack[-1][0] == query:
+            return list(stack[-1][1])
+
+        if len(query) >= _GRAM and _SEPARATOR not in query and (not stack or len(stack[-1][0]) < _GRAM):
+            results = self._lookup(query)
+        elif stack:
+            texts = self._texts
+            results = [record for record in stack[-1][1] if query in texts[record]]
+        else:
+            results = [record for (record, text) in self._texts.items() if query in text]
+        stack.append((query, results))
+        del stack[:-_STACK_SIZE]
+        return list(results)
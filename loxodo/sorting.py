@@ -0,0 +1,146 @@
+#
+# Loxodo -- Password Safe V3 compatible Password Vault
+# Copyright (C) 2008 Christoph Sommer <mail@christoph-sommer.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+Sort orders of the Records of a Vault, kept up to date as Records change.
+
+A SortIndex holds the sort key of each Record, computed once, and the Records
+in order of these keys.  Ordering a subset of the Records, such as the result
+of a search, then means picking them out of this permutation (or sorting them
+by their rank in it) instead of re-computing keys and re-sorting.
+"""
+
+from bisect import bisect_left
+from itertools import count, groupby
+
+# column -> (sort key of a Record, field types the key depends on)
+COLUMNS = {
+    "title": (lambda record: record.title.casefold(), (0x03,)),
+    "user": (lambda record: record.user.casefold(), (0x04,)),
+    "group": (lambda record: record.group.casefold(), (0x02,)),
+    "last_mod": (lambda record: record.last_mod, (0x0c,)),
+}
+
+# order a subset by rank rather than by scanning the whole permutation if it is at most this big a fraction
+_RANK_FRACTION = 8
+
+
+class SortIndex:
+    """
+    Records sorted by one or more columns of COLUMNS, ties broken by order of insertion.
+
+    The first column is the most significant one; the others only order Records that are
+    equal in all columns before them.
+    """
+    def __init__(self, records=(), columns=("group",)):
+        self.columns = tuple(columns)
+        self._key_functions = [COLUMNS[column][0] for column in self.columns]
+        self._fields = set()
+        for column in self.columns:
+            self._fields.update(COLUMNS[column][1])
+        self._counter = count()
+        self._keys = {}
+        for record in records:
+            self._keys[record] = self._key(record, next(self._counter))
+        self._order = sorted(self._keys, key=self._keys.__getitem__)
+        self._sorted_keys = [self._keys[record] for record in self._order]
+        self._reversed = None
+        self._ranks = {}
+
+    def __len__(self):
+        return len(self._order)
+
+    def _key(self, record, serial):
+        return tuple(key_function(record) for key_function in self._key_functions) + (serial,)
+
+    def _changed(self):
+        self._reversed = None
+        self._ranks = {}
+
+    def _insert(self, record, key):
+        i = bisect_left(self._sorted_keys, key)
+        self._sorted_keys.insert(i, key)
+        self._order.insert(i, record)
+        self._keys[record] = key
+        self._changed()
+
+    def add(self, record):
+        """
+        Add a Record to the order, or move it to its new place.
+        """
+        old_key = self._keys.get(record)
+        if old_key is None:
+            self._insert(record, self._key(record, next(self._counter)))
+            return
+        key = self._key(record, old_key[-1])
+        if key != old_key:
+            self.remove(record)
+            self._insert(record, key)
+
+    def remove(self, record):
+        """
+        Remove a Record from the order.
+        """
+        key = self._keys.pop(record, None)
+        if key is None:
+            return
+        i = bisect_left(self._sorted_keys, key)
+        del self._sorted_keys[i]
+        del self._order[i]
+        self._changed()
+
+    def record_added(self, record):
+        self.add(record)
+
+    def record_removed(self, record):
+        self.remove(record)
+
+    def field_changed(self, record, raw_type):
+        if raw_type in self._fields and record in self._keys:
+            self.add(record)
+
+    def _permutation(self, reverse):
+        """
+        Return all Records in order, with the first column descending if reverse is set.
+        """
+        if not reverse:
+            return self._order
+        if self._reversed is None:
+            keys = self._keys
+            groups = [list(group) for (dummy, group) in groupby(self._order, key=lambda record: keys[record][0])]
+            groups.reverse()
+            self._reversed = [record for group in groups for record in group]
+        return self._reversed
+
+    def sort(self, records, reverse=False):
+        """
+        Return a new list of the given Records (all of which must be in the index) in sort order.
+
+        reverse only applies to the first column: Records equal in it keep the order of the others.
+        """
+        order = self._permutation(reverse)
+        if len(records) >= len(order):
+            return list(order)
+        if len(records) * _RANK_FRACTION > len(order):
+            members = set(records)
+            return [record for record in order if record in members]
+        ranks = self._ranks.get(reverse)
+        if ranks is None:
+            ranks = self._ranks[reverse] = {record: i for (i, record) in enumerate(order)}
+        return sorted(records, key=ranks.__getitem__)
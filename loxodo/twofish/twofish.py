@@ -33,9 +33,15 @@
 ## Anyone thinking of using this code should reconsider. It's slow.
 ## Try python-mcrypt instead. In case a faster library is not installed
 ## on the target system, this code can be used as a portable fallback.
+##
+## Loxodo: the key-independent tables are built once at import time, the
+## key-dependent S-boxes are folded with the MDS matrix into four flat
+## tables and the 16 rounds are fully unrolled.
 
 # pylint: disable-all
 
+import struct
+
 xrange = range
 
 block_size = 16
@@ -66,12 +72,7 @@ class Twofish:
         
         self.context = TWI()
         
-        key_word32 = [0] * 32
-        i = 0
-        while key:
-            key_word32[i] = struct.unpack("<L", key[0:4])[0]
-            key = key[4:]
-            i += 1
+        key_word32 = list(struct.unpack("<%dL" % (key_len // 4), key))
 
         set_key(self.context, key_word32, key_len)
 
@@ -82,16 +83,10 @@ class Twofish:
         if len(block) % 16:
             raise ValueError("block size must be a multiple of 16")
 
-        plaintext = b''
-        
-        while block:
-            a, b, c, d = struct.unpack("<4L", block[:16])
-            temp = [a, b, c, d]
-            decrypt(self.context, temp)
-            plaintext += struct.pack("<4L", *temp)
-            block = block[16:]
-            
-        return plaintext
+        fmt = "<%dL" % (len(block) // 4)
+        words = list(struct.unpack(fmt, block))
+        decrypt(self.context, words)
+        return struct.pack(fmt, *words)
 
         
     def encrypt(self, block):
@@ -100,16 +95,10 @@ class Twofish:
         if len(block) % 16:
             raise ValueError("block size must be a multiple of 16")
 
-        ciphertext = b''
-        
-        while block:
-            a, b, c, d = struct.unpack("<4L", block[0:16])
-            temp = [a, b, c, d]
-            encrypt(self.context, temp)
-            ciphertext += struct.pack("<4L", *temp)
-            block = block[16:]
-            
-        return ciphertext
+        fmt = "<%dL" % (len(block) // 4)
+        words = list(struct.unpack(fmt, block))
+        encrypt(self.context, words)
+        return struct.pack(fmt, *words)
 
 
     def get_name(self):
@@ -134,49 +123,33 @@ class Twofish:
 # Private.
 #
 
-import struct
-import sys
-
-WORD_BIGENDIAN = 0
-if sys.byteorder == 'big':
-    WORD_BIGENDIAN = 1
-
 def rotr32(x, n):
     return (x >> n) | ((x << (32 - n)) & 0xFFFFFFFF)
 
 def rotl32(x, n):
     return ((x << n) & 0xFFFFFFFF) | (x >> (32 - n))
 
-def byteswap32(x):
-    return ((x & 0xff) << 24) | (((x >> 8) & 0xff) << 16) | \
-           (((x >> 16) & 0xff) << 8) | ((x >> 24) & 0xff)
-
 class TWI:
     def __init__(self):
         self.k_len = 0 # word32
-        self.l_key = [0]*40 # word32
-        self.s_key = [0]*4 # word32
-        self.qt_gen = 0 # word32
-        self.q_tab = [[0]*256, [0]*256] # byte
-        self.mt_gen = 0 # word32
-        self.m_tab = [[0]*256, [0]*256, [0]*256, [0]*256] # word32
-        self.mk_tab = [[0]*256, [0]*256, [0]*256, [0]*256] # word32
+        self.l_key = (0,) * 40 # word32
+        self.mk_tab = ((0,) * 256,) * 4 # word32, key-dependent S-boxes merged with MDS
 
 def byte(x, n):
     return (x >> (8 * n)) & 0xff
 
-tab_5b = [0, 90, 180, 238]
-tab_ef = [0, 238, 180, 90]
-ror4 = [0, 8, 1, 9, 2, 10, 3, 11, 4, 12, 5, 13, 6, 14, 7, 15]
-ashx = [0, 9, 2, 11, 4, 13, 6, 15, 8, 1, 10, 3, 12, 5, 14, 7]
-qt0 = [[8, 1, 7, 13, 6, 15, 3, 2, 0, 11, 5, 9, 14, 12, 10, 4],
-       [2, 8, 11, 13, 15, 7, 6, 14, 3, 1, 9, 4, 0, 10, 12, 5]]
-qt1 = [[14, 12, 11, 8, 1, 2, 3, 5, 15, 4, 10, 6, 7, 0, 9, 13],
-       [1, 14, 2, 11, 4, 12, 3, 7, 6, 13, 10, 5, 15, 9, 0, 8]]
-qt2 = [[11, 10, 5, 14, 6, 13, 9, 0, 12, 8, 15, 3, 2, 4, 7, 1],
-       [4, 12, 7, 5, 1, 6, 9, 10, 0, 14, 13, 8, 2, 11, 3, 15]]
-qt3 = [[13, 7, 15, 4, 1, 2, 6, 14, 9, 11, 3, 0, 8, 5, 12, 10],
-       [11, 9, 5, 1, 12, 3, 13, 14, 6, 4, 7, 15, 2, 0, 8, 10]]
+tab_5b = (0, 90, 180, 238)
+tab_ef = (0, 238, 180, 90)
+ror4 = (0, 8, 1, 9, 2, 10, 3, 11, 4, 12, 5, 13, 6, 14, 7, 15)
+ashx = (0, 9, 2, 11, 4, 13, 6, 15, 8, 1, 10, 3, 12, 5, 14, 7)
+qt0 = ((8, 1, 7, 13, 6, 15, 3, 2, 0, 11, 5, 9, 14, 12, 10, 4),
+       (2, 8, 11, 13, 15, 7, 6, 14, 3, 1, 9, 4, 0, 10, 12, 5))
+qt1 = ((14, 12, 11, 8, 1, 2, 3, 5, 15, 4, 10, 6, 7, 0, 9, 13),
+       (1, 14, 2, 11, 4, 12, 3, 7, 6, 13, 10, 5, 15, 9, 0, 8))
+qt2 = ((11, 10, 5, 14, 6, 13, 9, 0, 12, 8, 15, 3, 2, 4, 7, 1),
+       (4, 12, 7, 5, 1, 6, 9, 10, 0, 14, 13, 8, 2, 11, 3, 15))
+qt3 = ((13, 7, 15, 4, 1, 2, 6, 14, 9, 11, 3, 0, 8, 5, 12, 10),
+       (11, 9, 5, 1, 12, 3, 13, 14, 6, 4, 7, 15, 2, 0, 8, 10))
 
 def qp(n, x): # word32, byte
     n %= 0x100000000
@@ -193,70 +166,59 @@ def qp(n, x): # word32, byte
     b4 = qt3[n][b3];
     return (b4 << 4) | a4;
 
-def gen_qtab(pkey):
-    for i in xrange(256):
-        pkey.q_tab[0][i] = qp(0, i)
-        pkey.q_tab[1][i] = qp(1, i)
-        
-def gen_mtab(pkey):
+def gen_qtab():
+    return (tuple(qp(0, i) for i in xrange(256)),
+            tuple(qp(1, i) for i in xrange(256)))
+
+def gen_mtab(q_tab):
+    m_tab = ([0]*256, [0]*256, [0]*256, [0]*256)
     for i in xrange(256):
-        f01 = pkey.q_tab[1][i]
-        f01 = pkey.q_tab[1][i];
+        f01 = q_tab[1][i];
         f5b = ((f01) ^ ((f01) >> 2) ^ tab_5b[(f01) & 3]);
         fef = ((f01) ^ ((f01) >> 1) ^ ((f01) >> 2) ^ tab_ef[(f01) & 3]);
-        pkey.m_tab[0][i] = f01 + (f5b << 8) + (fef << 16) + (fef << 24);
-        pkey.m_tab[2][i] = f5b + (fef << 8) + (f01 << 16) + (fef << 24);
+        m_tab[0][i] = f01 + (f5b << 8) + (fef << 16) + (fef << 24);
+        m_tab[2][i] = f5b + (fef << 8) + (f01 << 16) + (fef << 24);
 
-        f01 = pkey.q_tab[0][i];
+        f01 = q_tab[0][i];
         f5b = ((f01) ^ ((f01) >> 2) ^ tab_5b[(f01) & 3]);
         fef = ((f01) ^ ((f01) >> 1) ^ ((f01) >> 2) ^ tab_ef[(f01) & 3]);
-        pkey.m_tab[1][i] = fef + (fef << 8) + (f5b << 16) + (f01 << 24);
-        pkey.m_tab[3][i] = f5b + (f01 << 8) + (fef << 16) + (f5b << 24);
-
-def gen_mk_tab(pkey, key):
-    if pkey.k_len == 2:
-        for i in xrange(256):
-            by = i % 0x100
-            pkey.mk_tab[0][i] = pkey.m_tab[0][pkey.q_tab[0][pkey.q_tab[0][by] ^ byte(key[1],0)] ^ byte(key[0],0)];
-            pkey.mk_tab[1][i] = pkey.m_tab[1][pkey.q_tab[0][pkey.q_tab[1][by] ^ byte(key[1],1)] ^ byte(key[0],1)];
-            pkey.mk_tab[2][i] = pkey.m_tab[2][pkey.q_tab[1][pkey.q_tab[0][by] ^ byte(key[1],2)] ^ byte(key[0],2)];
-            pkey.mk_tab[3][i] = pkey.m_tab[3][pkey.q_tab[1][pkey.q_tab[1][by] ^ byte(key[1],3)] ^ byte(key[0],3)];
-    if pkey.k_len == 3:
-        for i in xrange(256):
-            by = i % 0x100
-            pkey.mk_tab[0][i] = pkey.m_tab[0][pkey.q_tab[0][pkey.q_tab[0][pkey.q_tab[1][by] ^ byte(key[2], 0)] ^ byte(key[1], 0)] ^ byte(key[0], 0)];
-            pkey.mk_tab[1][i] = pkey.m_tab[1][pkey.q_tab[0][pkey.q_tab[1][pkey.q_tab[1][by] ^ byte(key[2], 1)] ^ byte(key[1], 1)] ^ byte(key[0], 1)];
-            pkey.mk_tab[2][i] = pkey.m_tab[2][pkey.q_tab[1][pkey.q_tab[0][pkey.q_tab[0][by] ^ byte(key[2], 2)] ^ byte(key[1], 2)] ^ byte(key[0], 2)];
-            pkey.mk_tab[3][i] = pkey.m_tab[3][pkey.q_tab[1][pkey.q_tab[1][pkey.q_tab[0][by] ^ byte(key[2], 3)] ^ byte(key[1], 3)] ^ byte(key[0], 3)];
-    if pkey.k_len == 4:
-        for i in xrange(256):
-            by = i % 0x100
-            pkey.mk_tab[0][i] = pkey.m_tab[0][pkey.q_tab[0][pkey.q_tab[0][pkey.q_tab[1][pkey.q_tab[1][by] ^ byte(key[3], 0)] ^ byte(key[2], 0)] ^ byte(key[1], 0)] ^ byte(key[0], 0)];
-            pkey.mk_tab[1][i] = pkey.m_tab[1][pkey.q_tab[0][pkey.q_tab[1][pkey.q_tab[1][pkey.q_tab[0][by] ^ byte(key[3], 1)] ^ byte(key[2], 1)] ^ byte(key[1], 1)] ^ byte(key[0], 1)];
-            pkey.mk_tab[2][i] = pkey.m_tab[2][pkey.q_tab[1][pkey.q_tab[0][pkey.q_tab[0][pkey.q_tab[0][by] ^ byte(key[3], 2)] ^ byte(key[2], 2)] ^ byte(key[1], 2)] ^ byte(key[0], 2)];
-            pkey.mk_tab[3][i] = pkey.m_tab[3][pkey.q_tab[1][pkey.q_tab[1][pkey.q_tab[0][pkey.q_tab[1][by] ^ byte(key[3], 3)] ^ byte(key[2], 3)] ^ byte(key[1], 3)] ^ byte(key[0], 3)];
-
-def h_fun(pkey, x, key):
-    b0 = byte(x, 0);
-    b1 = byte(x, 1);
-    b2 = byte(x, 2);
-    b3 = byte(x, 3);
-    if pkey.k_len >= 4:
-        b0 = pkey.q_tab[1][b0] ^ byte(key[3], 0);
-        b1 = pkey.q_tab[0][b1] ^ byte(key[3], 1);
-        b2 = pkey.q_tab[0][b2] ^ byte(key[3], 2);
-        b3 = pkey.q_tab[1][b3] ^ byte(key[3], 3);
-    if pkey.k_len >= 3:
-        b0 = pkey.q_tab[1][b0] ^ byte(key[2], 0);
-        b1 = pkey.q_tab[1][b1] ^ byte(key[2], 1);
-        b2 = pkey.q_tab[0][b2] ^ byte(key[2], 2);
-        b3 = pkey.q_tab[0][b3] ^ byte(key[2], 3);
-    if pkey.k_len >= 2:
-        b0 = pkey.q_tab[0][pkey.q_tab[0][b0] ^ byte(key[1], 0)] ^ byte(key[0], 0);
-        b1 = pkey.q_tab[0][pkey.q_tab[1][b1] ^ byte(key[1], 1)] ^ byte(key[0], 1);
-        b2 = pkey.q_tab[1][pkey.q_tab[0][b2] ^ byte(key[1], 2)] ^ byte(key[0], 2);
-        b3 = pkey.q_tab[1][pkey.q_tab[1][b3] ^ byte(key[1], 3)] ^ byte(key[0], 3);      
-    return pkey.m_tab[0][b0] ^ pkey.m_tab[1][b1] ^ pkey.m_tab[2][b2] ^ pkey.m_tab[3][b3];   
+        m_tab[1][i] = fef + (fef << 8) + (f5b << 16) + (f01 << 24);
+        m_tab[3][i] = f5b + (f01 << 8) + (fef << 16) + (f5b << 24);
+    return tuple(tuple(m) for m in m_tab)
+
+# The q permutations and the MDS multiplication tables do not depend on the
+# key, so they are computed once per process instead of once per set_key().
+q_tab = gen_qtab()
+m_tab = gen_mtab(q_tab)
+
+# q permutation applied to byte n of the h function input for each 32-bit key
+# word, innermost (key[3]) first.  Only the last k_len rows are used.
+q_order = ((q_tab[1], q_tab[0], q_tab[0], q_tab[1]),  # key[3]
+           (q_tab[1], q_tab[1], q_tab[0], q_tab[0]),  # key[2]
+           (q_tab[0], q_tab[1], q_tab[0], q_tab[1]),  # key[1]
+           (q_tab[0], q_tab[0], q_tab[1], q_tab[1]))  # key[0]
+
+def h_fun(k_len, x, key):
+    b = [byte(x, 0), byte(x, 1), byte(x, 2), byte(x, 3)]
+    for stage in xrange(4 - k_len, 4):
+        k = key[3 - stage]
+        q = q_order[stage]
+        for n in xrange(4):
+            b[n] = q[n][b[n]] ^ byte(k, n)
+    return m_tab[0][b[0]] ^ m_tab[1][b[1]] ^ m_tab[2][b[2]] ^ m_tab[3][b[3]]
+
+def gen_mk_tab(k_len, key):
+    """Fold the key-dependent S-boxes and the MDS matrix into four flat tables."""
+    mk_tab = []
+    for n in xrange(4):
+        col = list(xrange(256))
+        for stage in xrange(4 - k_len, 4):
+            q = q_order[stage][n]
+            k = byte(key[3 - stage], n)
+            col = [q[i] ^ k for i in col]
+        m = m_tab[n]
+        mk_tab.append(tuple([m[i] for i in col]))
+    return tuple(mk_tab)
 
 def mds_rem(p0, p1):
     i, t, u = 0, 0, 0
@@ -275,121 +237,472 @@ def mds_rem(p0, p1):
     return p1
 
 def set_key(pkey, in_key, key_len):
-    pkey.qt_gen = 0
-    if not pkey.qt_gen:
-        gen_qtab(pkey)
-        pkey.qt_gen = 1
-    pkey.mt_gen = 0
-    if not pkey.mt_gen:
-        gen_mtab(pkey)
-        pkey.mt_gen = 1
     pkey.k_len = (key_len * 8) // 64
 
-    a = 0
-    b = 0
     me_key = [0,0,0,0]
     mo_key = [0,0,0,0]
+    s_key = [0,0,0,0]
     for i in xrange(pkey.k_len):
-        if WORD_BIGENDIAN:
-            a = byteswap32(in_key[i + 1])
-            me_key[i] = a            
-            b = byteswap32(in_key[i + i + 1])
-        else:
-            a = in_key[i + i]
-            me_key[i] = a            
-            b = in_key[i + i + 1]
+        a = in_key[i + i]
+        me_key[i] = a
+        b = in_key[i + i + 1]
         mo_key[i] = b
-        pkey.s_key[pkey.k_len - i - 1] = mds_rem(a, b);
+        s_key[pkey.k_len - i - 1] = mds_rem(a, b);
+    l_key = [0] * 40
     for i in xrange(0, 40, 2):
         a = (0x01010101 * i) % 0x100000000;
         b = (a + 0x01010101) % 0x100000000;
-        a = h_fun(pkey, a, me_key);
-        b = rotl32(h_fun(pkey, b, mo_key), 8);
-        pkey.l_key[i] = (a + b) % 0x100000000;
-        pkey.l_key[i + 1] = rotl32((a + 2 * b) % 0x100000000, 9);
-    gen_mk_tab(pkey, pkey.s_key)
+        a = h_fun(pkey.k_len, a, me_key);
+        b = rotl32(h_fun(pkey.k_len, b, mo_key), 8);
+        l_key[i] = (a + b) % 0x100000000;
+        l_key[i + 1] = rotl32((a + 2 * b) % 0x100000000, 9);
+    pkey.l_key = tuple(l_key)
+    pkey.mk_tab = gen_mk_tab(pkey.k_len, s_key)
+
+# encrypt() and decrypt() work in place on a list of 4*n words, i.e. on any
+# number of blocks at once.  The rounds are fully unrolled and the round keys
+# and tables are kept in local variables; attribute and index lookups on pkey
+# dominate the running time of the rolled-up version.
 
 def encrypt(pkey, in_blk):
-    blk = [0, 0, 0, 0]
-
-    if WORD_BIGENDIAN:
-        blk[0] = byteswap32(in_blk[0]) ^ pkey.l_key[0];
-        blk[1] = byteswap32(in_blk[1]) ^ pkey.l_key[1];
-        blk[2] = byteswap32(in_blk[2]) ^ pkey.l_key[2];
-        blk[3] = byteswap32(in_blk[3]) ^ pkey.l_key[3];
-    else:
-        blk[0] = in_blk[0] ^ pkey.l_key[0];
-        blk[1] = in_blk[1] ^ pkey.l_key[1];
-        blk[2] = in_blk[2] ^ pkey.l_key[2];
-        blk[3] = in_blk[3] ^ pkey.l_key[3];        
-
-    for i in xrange(8):
-        t1 = ( pkey.mk_tab[0][byte(blk[1],3)] ^ pkey.mk_tab[1][byte(blk[1],0)] ^ pkey.mk_tab[2][byte(blk[1],1)] ^ pkey.mk_tab[3][byte(blk[1],2)] ); 
-        t0 = ( pkey.mk_tab[0][byte(blk[0],0)] ^ pkey.mk_tab[1][byte(blk[0],1)] ^ pkey.mk_tab[2][byte(blk[0],2)] ^ pkey.mk_tab[3][byte(blk[0],3)] );
-        
-        blk[2] = rotr32(blk[2] ^ ((t0 + t1 + pkey.l_key[4 * (i) + 8]) % 0x100000000), 1);
-        blk[3] = rotl32(blk[3], 1) ^ ((t0 + 2 * t1 + pkey.l_key[4 * (i) + 9]) % 0x100000000);
-
-        t1 = ( pkey.mk_tab[0][byte(blk[3],3)] ^ pkey.mk_tab[1][byte(blk[3],0)] ^ pkey.mk_tab[2][byte(blk[3],1)] ^ pkey.mk_tab[3][byte(blk[3],2)] ); 
-        t0 = ( pkey.mk_tab[0][byte(blk[2],0)] ^ pkey.mk_tab[1][byte(blk[2],1)] ^ pkey.mk_tab[2][byte(blk[2],2)] ^ pkey.mk_tab[3][byte(blk[2],3)] );
-        
-        blk[0] = rotr32(blk[0] ^ ((t0 + t1 + pkey.l_key[4 * (i) + 10]) % 0x100000000), 1);
-        blk[1] = rotl32(blk[1], 1) ^ ((t0 + 2 * t1 + pkey.l_key[4 * (i) + 11]) % 0x100000000);         
-
-    if WORD_BIGENDIAN:
-        in_blk[0] = byteswap32(blk[2] ^ pkey.l_key[4]);
-        in_blk[1] = byteswap32(blk[3] ^ pkey.l_key[5]);
-        in_blk[2] = byteswap32(blk[0] ^ pkey.l_key[6]);
-        in_blk[3] = byteswap32(blk[1] ^ pkey.l_key[7]);
-    else:
-        in_blk[0] = blk[2] ^ pkey.l_key[4];
-        in_blk[1] = blk[3] ^ pkey.l_key[5];
-        in_blk[2] = blk[0] ^ pkey.l_key[6];
-        in_blk[3] = blk[1] ^ pkey.l_key[7];
-        
+    (k0, k1, k2, k3, k4, k5, k6, k7, k8, k9,
+     k10, k11, k12, k13, k14, k15, k16, k17, k18, k19,
+     k20, k21, k22, k23, k24, k25, k26, k27, k28, k29,
+     k30, k31, k32, k33, k34, k35, k36, k37, k38, k39) = pkey.l_key
+    mk0, mk1, mk2, mk3 = pkey.mk_tab
+
+    for i in xrange(0, len(in_blk), 4):
+        a = in_blk[i] ^ k0
+        b = in_blk[i + 1] ^ k1
+        c = in_blk[i + 2] ^ k2
+        d = in_blk[i + 3] ^ k3
+
+        # rounds 1 and 2
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c ^= (t0 + t1 + k8) & 0xffffffff
+        c = (c >> 1) | ((c << 31) & 0xffffffff)
+        d = (((d << 1) & 0xffffffff) | (d >> 31)) ^ ((t0 + 2 * t1 + k9) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a ^= (t0 + t1 + k10) & 0xffffffff
+        a = (a >> 1) | ((a << 31) & 0xffffffff)
+        b = (((b << 1) & 0xffffffff) | (b >> 31)) ^ ((t0 + 2 * t1 + k11) & 0xffffffff)
+        # rounds 3 and 4
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c ^= (t0 + t1 + k12) & 0xffffffff
+        c = (c >> 1) | ((c << 31) & 0xffffffff)
+        d = (((d << 1) & 0xffffffff) | (d >> 31)) ^ ((t0 + 2 * t1 + k13) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a ^= (t0 + t1 + k14) & 0xffffffff
+        a = (a >> 1) | ((a << 31) & 0xffffffff)
+        b = (((b << 1) & 0xffffffff) | (b >> 31)) ^ ((t0 + 2 * t1 + k15) & 0xffffffff)
+        # rounds 5 and 6
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c ^= (t0 + t1 + k16) & 0xffffffff
+        c = (c >> 1) | ((c << 31) & 0xffffffff)
+        d = (((d << 1) & 0xffffffff) | (d >> 31)) ^ ((t0 + 2 * t1 + k17) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a ^= (t0 + t1 + k18) & 0xffffffff
+        a = (a >> 1) | ((a << 31) & 0xffffffff)
+        b = (((b << 1) & 0xffffffff) | (b >> 31)) ^ ((t0 + 2 * t1 + k19) & 0xffffffff)
+        # rounds 7 and 8
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c ^= (t0 + t1 + k20) & 0xffffffff
+        c = (c >> 1) | ((c << 31) & 0xffffffff)
+        d = (((d << 1) & 0xffffffff) | (d >> 31)) ^ ((t0 + 2 * t1 + k21) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a ^= (t0 + t1 + k22) & 0xffffffff
+        a = (a >> 1) | ((a << 31) & 0xffffffff)
+        b = (((b << 1) & 0xffffffff) | (b >> 31)) ^ ((t0 + 2 * t1 + k23) & 0xffffffff)
+        # rounds 9 and 10
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c ^= (t0 + t1 + k24) & 0xffffffff
+        c = (c >> 1) | ((c << 31) & 0xffffffff)
+        d = (((d << 1) & 0xffffffff) | (d >> 31)) ^ ((t0 + 2 * t1 + k25) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a ^= (t0 + t1 + k26) & 0xffffffff
+        a = (a >> 1) | ((a << 31) & 0xffffffff)
+        b = (((b << 1) & 0xffffffff) | (b >> 31)) ^ ((t0 + 2 * t1 + k27) & 0xffffffff)
+        # rounds 11 and 12
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c ^= (t0 + t1 + k28) & 0xffffffff
+        c = (c >> 1) | ((c << 31) & 0xffffffff)
+        d = (((d << 1) & 0xffffffff) | (d >> 31)) ^ ((t0 + 2 * t1 + k29) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a ^= (t0 + t1 + k30) & 0xffffffff
+        a = (a >> 1) | ((a << 31) & 0xffffffff)
+        b = (((b << 1) & 0xffffffff) | (b >> 31)) ^ ((t0 + 2 * t1 + k31) & 0xffffffff)
+        # rounds 13 and 14
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c ^= (t0 + t1 + k32) & 0xffffffff
+        c = (c >> 1) | ((c << 31) & 0xffffffff)
+        d = (((d << 1) & 0xffffffff) | (d >> 31)) ^ ((t0 + 2 * t1 + k33) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a ^= (t0 + t1 + k34) & 0xffffffff
+        a = (a >> 1) | ((a << 31) & 0xffffffff)
+        b = (((b << 1) & 0xffffffff) | (b >> 31)) ^ ((t0 + 2 * t1 + k35) & 0xffffffff)
+        # rounds 15 and 16
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c ^= (t0 + t1 + k36) & 0xffffffff
+        c = (c >> 1) | ((c << 31) & 0xffffffff)
+        d = (((d << 1) & 0xffffffff) | (d >> 31)) ^ ((t0 + 2 * t1 + k37) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a ^= (t0 + t1 + k38) & 0xffffffff
+        a = (a >> 1) | ((a << 31) & 0xffffffff)
+        b = (((b << 1) & 0xffffffff) | (b >> 31)) ^ ((t0 + 2 * t1 + k39) & 0xffffffff)
+
+        in_blk[i] = c ^ k4
+        in_blk[i + 1] = d ^ k5
+        in_blk[i + 2] = a ^ k6
+        in_blk[i + 3] = b ^ k7
     return
 
 def decrypt(pkey, in_blk):
-    blk = [0, 0, 0, 0]
-    
-    if WORD_BIGENDIAN:
-        blk[0] = byteswap32(in_blk[0]) ^ pkey.l_key[4];
-        blk[1] = byteswap32(in_blk[1]) ^ pkey.l_key[5];
-        blk[2] = byteswap32(in_blk[2]) ^ pkey.l_key[6];
-        blk[3] = byteswap32(in_blk[3]) ^ pkey.l_key[7];
-    else:
-        blk[0] = in_blk[0] ^ pkey.l_key[4];
-        blk[1] = in_blk[1] ^ pkey.l_key[5];
-        blk[2] = in_blk[2] ^ pkey.l_key[6];
-        blk[3] = in_blk[3] ^ pkey.l_key[7];    
-
-    for i in xrange(7, -1, -1):
-        t1 = ( pkey.mk_tab[0][byte(blk[1],3)] ^ pkey.mk_tab[1][byte(blk[1],0)] ^ pkey.mk_tab[2][byte(blk[1],1)] ^ pkey.mk_tab[3][byte(blk[1],2)] )
-        t0 = ( pkey.mk_tab[0][byte(blk[0],0)] ^ pkey.mk_tab[1][byte(blk[0],1)] ^ pkey.mk_tab[2][byte(blk[0],2)] ^ pkey.mk_tab[3][byte(blk[0],3)] )
-
-        blk[2] = rotl32(blk[2], 1) ^ ((t0 + t1 + pkey.l_key[4 * (i) + 10]) % 0x100000000)
-        blk[3] = rotr32(blk[3] ^ ((t0 + 2 * t1 + pkey.l_key[4 * (i) + 11]) % 0x100000000), 1)
-
-        t1 = ( pkey.mk_tab[0][byte(blk[3],3)] ^ pkey.mk_tab[1][byte(blk[3],0)] ^ pkey.mk_tab[2][byte(blk[3],1)] ^ pkey.mk_tab[3][byte(blk[3],2)] )
-        t0 = ( pkey.mk_tab[0][byte(blk[2],0)] ^ pkey.mk_tab[1][byte(blk[2],1)] ^ pkey.mk_tab[2][byte(blk[2],2)] ^ pkey.mk_tab[3][byte(blk[2],3)] )
-
-        blk[0] = rotl32(blk[0], 1) ^ ((t0 + t1 + pkey.l_key[4 * (i) + 8]) % 0x100000000)
-        blk[1] = rotr32(blk[1] ^ ((t0 + 2 * t1 + pkey.l_key[4 * (i) + 9]) % 0x100000000), 1)        
-
-    if WORD_BIGENDIAN:
-        in_blk[0] = byteswap32(blk[2] ^ pkey.l_key[0]);
-        in_blk[1] = byteswap32(blk[3] ^ pkey.l_key[1]);
-        in_blk[2] = byteswap32(blk[0] ^ pkey.l_key[2]);
-        in_blk[3] = byteswap32(blk[1] ^ pkey.l_key[3]);
-    else:
-        in_blk[0] = blk[2] ^ pkey.l_key[0];
-        in_blk[1] = blk[3] ^ pkey.l_key[1];
-        in_blk[2] = blk[0] ^ pkey.l_key[2];
-        in_blk[3] = blk[1] ^ pkey.l_key[3];
+    (k0, k1, k2, k3, k4, k5, k6, k7, k8, k9,
+     k10, k11, k12, k13, k14, k15, k16, k17, k18, k19,
+     k20, k21, k22, k23, k24, k25, k26, k27, k28, k29,
+     k30, k31, k32, k33, k34, k35, k36, k37, k38, k39) = pkey.l_key
+    mk0, mk1, mk2, mk3 = pkey.mk_tab
+
+    for i in xrange(0, len(in_blk), 4):
+        a = in_blk[i] ^ k4
+        b = in_blk[i + 1] ^ k5
+        c = in_blk[i + 2] ^ k6
+        d = in_blk[i + 3] ^ k7
+
+        # rounds 16 and 15
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c = (((c << 1) & 0xffffffff) | (c >> 31)) ^ ((t0 + t1 + k38) & 0xffffffff)
+        d ^= (t0 + 2 * t1 + k39) & 0xffffffff
+        d = (d >> 1) | ((d << 31) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a = (((a << 1) & 0xffffffff) | (a >> 31)) ^ ((t0 + t1 + k36) & 0xffffffff)
+        b ^= (t0 + 2 * t1 + k37) & 0xffffffff
+        b = (b >> 1) | ((b << 31) & 0xffffffff)
+        # rounds 14 and 13
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c = (((c << 1) & 0xffffffff) | (c >> 31)) ^ ((t0 + t1 + k34) & 0xffffffff)
+        d ^= (t0 + 2 * t1 + k35) & 0xffffffff
+        d = (d >> 1) | ((d << 31) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a = (((a << 1) & 0xffffffff) | (a >> 31)) ^ ((t0 + t1 + k32) & 0xffffffff)
+        b ^= (t0 + 2 * t1 + k33) & 0xffffffff
+        b = (b >> 1) | ((b << 31) & 0xffffffff)
+        # rounds 12 and 11
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c = (((c << 1) & 0xffffffff) | (c >> 31)) ^ ((t0 + t1 + k30) & 0xffffffff)
+        d ^= (t0 + 2 * t1 + k31) & 0xffffffff
+        d = (d >> 1) | ((d << 31) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a = (((a << 1) & 0xffffffff) | (a >> 31)) ^ ((t0 + t1 + k28) & 0xffffffff)
+        b ^= (t0 + 2 * t1 + k29) & 0xffffffff
+        b = (b >> 1) | ((b << 31) & 0xffffffff)
+        # rounds 10 and 9
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c = (((c << 1) & 0xffffffff) | (c >> 31)) ^ ((t0 + t1 + k26) & 0xffffffff)
+        d ^= (t0 + 2 * t1 + k27) & 0xffffffff
+        d = (d >> 1) | ((d << 31) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a = (((a << 1) & 0xffffffff) | (a >> 31)) ^ ((t0 + t1 + k24) & 0xffffffff)
+        b ^= (t0 + 2 * t1 + k25) & 0xffffffff
+        b = (b >> 1) | ((b << 31) & 0xffffffff)
+        # rounds 8 and 7
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c = (((c << 1) & 0xffffffff) | (c >> 31)) ^ ((t0 + t1 + k22) & 0xffffffff)
+        d ^= (t0 + 2 * t1 + k23) & 0xffffffff
+        d = (d >> 1) | ((d << 31) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a = (((a << 1) & 0xffffffff) | (a >> 31)) ^ ((t0 + t1 + k20) & 0xffffffff)
+        b ^= (t0 + 2 * t1 + k21) & 0xffffffff
+        b = (b >> 1) | ((b << 31) & 0xffffffff)
+        # rounds 6 and 5
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c = (((c << 1) & 0xffffffff) | (c >> 31)) ^ ((t0 + t1 + k18) & 0xffffffff)
+        d ^= (t0 + 2 * t1 + k19) & 0xffffffff
+        d = (d >> 1) | ((d << 31) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a = (((a << 1) & 0xffffffff) | (a >> 31)) ^ ((t0 + t1 + k16) & 0xffffffff)
+        b ^= (t0 + 2 * t1 + k17) & 0xffffffff
+        b = (b >> 1) | ((b << 31) & 0xffffffff)
+        # rounds 4 and 3
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c = (((c << 1) & 0xffffffff) | (c >> 31)) ^ ((t0 + t1 + k14) & 0xffffffff)
+        d ^= (t0 + 2 * t1 + k15) & 0xffffffff
+        d = (d >> 1) | ((d << 31) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a = (((a << 1) & 0xffffffff) | (a >> 31)) ^ ((t0 + t1 + k12) & 0xffffffff)
+        b ^= (t0 + 2 * t1 + k13) & 0xffffffff
+        b = (b >> 1) | ((b << 31) & 0xffffffff)
+        # rounds 2 and 1
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c = (((c << 1) & 0xffffffff) | (c >> 31)) ^ ((t0 + t1 + k10) & 0xffffffff)
+        d ^= (t0 + 2 * t1 + k11) & 0xffffffff
+        d = (d >> 1) | ((d << 31) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a = (((a << 1) & 0xffffffff) | (a >> 31)) ^ ((t0 + t1 + k8) & 0xffffffff)
+        b ^= (t0 + 2 * t1 + k9) & 0xffffffff
+        b = (b >> 1) | ((b << 31) & 0xffffffff)
+
+        in_blk[i] = c ^ k0
+        in_blk[i + 1] = d ^ k1
+        in_blk[i + 2] = a ^ k2
+        in_blk[i + 3] = b ^ k3
     return
 
-__testkey = b'\xD4\x3B\xB7\x55\x6E\xA3\x2E\x46\xF2\xA2\x82\xB7\xD4\x5B\x4E\x0D\x57\xFF\x73\x9D\x4D\xC9\x2C\x1B\xD7\xFC\x01\x70\x0C\xC8\x21\x6F'
-__testdat = b'\x90\xAF\xE9\x1B\xB2\x88\x54\x4F\x2C\x32\xDC\x23\x9B\x26\x35\xE6'
-assert b'l\xb4V\x1c@\xbf\n\x97\x05\x93\x1c\xb6\xd4\x08\xe7\xfa' == Twofish(__testkey).encrypt(__testdat)
-assert __testdat == Twofish(__testkey).decrypt(b'l\xb4V\x1c@\xbf\n\x97\x05\x93\x1c\xb6\xd4\x08\xe7\xfa')
-
+# encrypt_cbc() and decrypt_cbc() are the same, with the CBC chaining folded
+# into the block loop.  iv and the returned chaining state are 4-tuples of
+# words, so no intermediate byte strings are created for the xor.
+
+def encrypt_cbc(pkey, in_blk, iv):
+    (k0, k1, k2, k3, k4, k5, k6, k7, k8, k9,
+     k10, k11, k12, k13, k14, k15, k16, k17, k18, k19,
+     k20, k21, k22, k23, k24, k25, k26, k27, k28, k29,
+     k30, k31, k32, k33, k34, k35, k36, k37, k38, k39) = pkey.l_key
+    mk0, mk1, mk2, mk3 = pkey.mk_tab
+    v0, v1, v2, v3 = iv
+
+    for i in xrange(0, len(in_blk), 4):
+        a = in_blk[i] ^ v0 ^ k0
+        b = in_blk[i + 1] ^ v1 ^ k1
+        c = in_blk[i + 2] ^ v2 ^ k2
+        d = in_blk[i + 3] ^ v3 ^ k3
+
+        # rounds 1 and 2
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c ^= (t0 + t1 + k8) & 0xffffffff
+        c = (c >> 1) | ((c << 31) & 0xffffffff)
+        d = (((d << 1) & 0xffffffff) | (d >> 31)) ^ ((t0 + 2 * t1 + k9) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a ^= (t0 + t1 + k10) & 0xffffffff
+        a = (a >> 1) | ((a << 31) & 0xffffffff)
+        b = (((b << 1) & 0xffffffff) | (b >> 31)) ^ ((t0 + 2 * t1 + k11) & 0xffffffff)
+        # rounds 3 and 4
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c ^= (t0 + t1 + k12) & 0xffffffff
+        c = (c >> 1) | ((c << 31) & 0xffffffff)
+        d = (((d << 1) & 0xffffffff) | (d >> 31)) ^ ((t0 + 2 * t1 + k13) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a ^= (t0 + t1 + k14) & 0xffffffff
+        a = (a >> 1) | ((a << 31) & 0xffffffff)
+        b = (((b << 1) & 0xffffffff) | (b >> 31)) ^ ((t0 + 2 * t1 + k15) & 0xffffffff)
+        # rounds 5 and 6
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c ^= (t0 + t1 + k16) & 0xffffffff
+        c = (c >> 1) | ((c << 31) & 0xffffffff)
+        d = (((d << 1) & 0xffffffff) | (d >> 31)) ^ ((t0 + 2 * t1 + k17) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a ^= (t0 + t1 + k18) & 0xffffffff
+        a = (a >> 1) | ((a << 31) & 0xffffffff)
+        b = (((b << 1) & 0xffffffff) | (b >> 31)) ^ ((t0 + 2 * t1 + k19) & 0xffffffff)
+        # rounds 7 and 8
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c ^= (t0 + t1 + k20) & 0xffffffff
+        c = (c >> 1) | ((c << 31) & 0xffffffff)
+        d = (((d << 1) & 0xffffffff) | (d >> 31)) ^ ((t0 + 2 * t1 + k21) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a ^= (t0 + t1 + k22) & 0xffffffff
+        a = (a >> 1) | ((a << 31) & 0xffffffff)
+        b = (((b << 1) & 0xffffffff) | (b >> 31)) ^ ((t0 + 2 * t1 + k23) & 0xffffffff)
+        # rounds 9 and 10
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c ^= (t0 + t1 + k24) & 0xffffffff
+        c = (c >> 1) | ((c << 31) & 0xffffffff)
+        d = (((d << 1) & 0xffffffff) | (d >> 31)) ^ ((t0 + 2 * t1 + k25) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a ^= (t0 + t1 + k26) & 0xffffffff
+        a = (a >> 1) | ((a << 31) & 0xffffffff)
+        b = (((b << 1) & 0xffffffff) | (b >> 31)) ^ ((t0 + 2 * t1 + k27) & 0xffffffff)
+        # rounds 11 and 12
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c ^= (t0 + t1 + k28) & 0xffffffff
+        c = (c >> 1) | ((c << 31) & 0xffffffff)
+        d = (((d << 1) & 0xffffffff) | (d >> 31)) ^ ((t0 + 2 * t1 + k29) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a ^= (t0 + t1 + k30) & 0xffffffff
+        a = (a >> 1) | ((a << 31) & 0xffffffff)
+        b = (((b << 1) & 0xffffffff) | (b >> 31)) ^ ((t0 + 2 * t1 + k31) & 0xffffffff)
+        # rounds 13 and 14
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c ^= (t0 + t1 + k32) & 0xffffffff
+        c = (c >> 1) | ((c << 31) & 0xffffffff)
+        d = (((d << 1) & 0xffffffff) | (d >> 31)) ^ ((t0 + 2 * t1 + k33) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a ^= (t0 + t1 + k34) & 0xffffffff
+        a = (a >> 1) | ((a << 31) & 0xffffffff)
+        b = (((b << 1) & 0xffffffff) | (b >> 31)) ^ ((t0 + 2 * t1 + k35) & 0xffffffff)
+        # rounds 15 and 16
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c ^= (t0 + t1 + k36) & 0xffffffff
+        c = (c >> 1) | ((c << 31) & 0xffffffff)
+        d = (((d << 1) & 0xffffffff) | (d >> 31)) ^ ((t0 + 2 * t1 + k37) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a ^= (t0 + t1 + k38) & 0xffffffff
+        a = (a >> 1) | ((a << 31) & 0xffffffff)
+        b = (((b << 1) & 0xffffffff) | (b >> 31)) ^ ((t0 + 2 * t1 + k39) & 0xffffffff)
+
+        in_blk[i] = v0 = c ^ k4
+        in_blk[i + 1] = v1 = d ^ k5
+        in_blk[i + 2] = v2 = a ^ k6
+        in_blk[i + 3] = v3 = b ^ k7
+    return (v0, v1, v2, v3)
+
+def decrypt_cbc(pkey, in_blk, iv):
+    (k0, k1, k2, k3, k4, k5, k6, k7, k8, k9,
+     k10, k11, k12, k13, k14, k15, k16, k17, k18, k19,
+     k20, k21, k22, k23, k24, k25, k26, k27, k28, k29,
+     k30, k31, k32, k33, k34, k35, k36, k37, k38, k39) = pkey.l_key
+    mk0, mk1, mk2, mk3 = pkey.mk_tab
+    v0, v1, v2, v3 = iv
+
+    for i in xrange(0, len(in_blk), 4):
+        x0 = in_blk[i]
+        x1 = in_blk[i + 1]
+        x2 = in_blk[i + 2]
+        x3 = in_blk[i + 3]
+        a = x0 ^ k4
+        b = x1 ^ k5
+        c = x2 ^ k6
+        d = x3 ^ k7
+
+        # rounds 16 and 15
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c = (((c << 1) & 0xffffffff) | (c >> 31)) ^ ((t0 + t1 + k38) & 0xffffffff)
+        d ^= (t0 + 2 * t1 + k39) & 0xffffffff
+        d = (d >> 1) | ((d << 31) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a = (((a << 1) & 0xffffffff) | (a >> 31)) ^ ((t0 + t1 + k36) & 0xffffffff)
+        b ^= (t0 + 2 * t1 + k37) & 0xffffffff
+        b = (b >> 1) | ((b << 31) & 0xffffffff)
+        # rounds 14 and 13
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c = (((c << 1) & 0xffffffff) | (c >> 31)) ^ ((t0 + t1 + k34) & 0xffffffff)
+        d ^= (t0 + 2 * t1 + k35) & 0xffffffff
+        d = (d >> 1) | ((d << 31) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a = (((a << 1) & 0xffffffff) | (a >> 31)) ^ ((t0 + t1 + k32) & 0xffffffff)
+        b ^= (t0 + 2 * t1 + k33) & 0xffffffff
+        b = (b >> 1) | ((b << 31) & 0xffffffff)
+        # rounds 12 and 11
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c = (((c << 1) & 0xffffffff) | (c >> 31)) ^ ((t0 + t1 + k30) & 0xffffffff)
+        d ^= (t0 + 2 * t1 + k31) & 0xffffffff
+        d = (d >> 1) | ((d << 31) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a = (((a << 1) & 0xffffffff) | (a >> 31)) ^ ((t0 + t1 + k28) & 0xffffffff)
+        b ^= (t0 + 2 * t1 + k29) & 0xffffffff
+        b = (b >> 1) | ((b << 31) & 0xffffffff)
+        # rounds 10 and 9
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c = (((c << 1) & 0xffffffff) | (c >> 31)) ^ ((t0 + t1 + k26) & 0xffffffff)
+        d ^= (t0 + 2 * t1 + k27) & 0xffffffff
+        d = (d >> 1) | ((d << 31) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a = (((a << 1) & 0xffffffff) | (a >> 31)) ^ ((t0 + t1 + k24) & 0xffffffff)
+        b ^= (t0 + 2 * t1 + k25) & 0xffffffff
+        b = (b >> 1) | ((b << 31) & 0xffffffff)
+        # rounds 8 and 7
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c = (((c << 1) & 0xffffffff) | (c >> 31)) ^ ((t0 + t1 + k22) & 0xffffffff)
+        d ^= (t0 + 2 * t1 + k23) & 0xffffffff
+        d = (d >> 1) | ((d << 31) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a = (((a << 1) & 0xffffffff) | (a >> 31)) ^ ((t0 + t1 + k20) & 0xffffffff)
+        b ^= (t0 + 2 * t1 + k21) & 0xffffffff
+        b = (b >> 1) | ((b << 31) & 0xffffffff)
+        # rounds 6 and 5
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c = (((c << 1) & 0xffffffff) | (c >> 31)) ^ ((t0 + t1 + k18) & 0xffffffff)
+        d ^= (t0 + 2 * t1 + k19) & 0xffffffff
+        d = (d >> 1) | ((d << 31) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a = (((a << 1) & 0xffffffff) | (a >> 31)) ^ ((t0 + t1 + k16) & 0xffffffff)
+        b ^= (t0 + 2 * t1 + k17) & 0xffffffff
+        b = (b >> 1) | ((b << 31) & 0xffffffff)
+        # rounds 4 and 3
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c = (((c << 1) & 0xffffffff) | (c >> 31)) ^ ((t0 + t1 + k14) & 0xffffffff)
+        d ^= (t0 + 2 * t1 + k15) & 0xffffffff
+        d = (d >> 1) | ((d << 31) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a = (((a << 1) & 0xffffffff) | (a >> 31)) ^ ((t0 + t1 + k12) & 0xffffffff)
+        b ^= (t0 + 2 * t1 + k13) & 0xffffffff
+        b = (b >> 1) | ((b << 31) & 0xffffffff)
+        # rounds 2 and 1
+        t0 = (mk0[a & 0xff] ^ mk1[(a >> 8) & 0xff] ^ mk2[(a >> 16) & 0xff] ^ mk3[a >> 24])
+        t1 = (mk0[b >> 24] ^ mk1[b & 0xff] ^ mk2[(b >> 8) & 0xff] ^ mk3[(b >> 16) & 0xff])
+        c = (((c << 1) & 0xffffffff) | (c >> 31)) ^ ((t0 + t1 + k10) & 0xffffffff)
+        d ^= (t0 + 2 * t1 + k11) & 0xffffffff
+        d = (d >> 1) | ((d << 31) & 0xffffffff)
+        t0 = (mk0[c & 0xff] ^ mk1[(c >> 8) & 0xff] ^ mk2[(c >> 16) & 0xff] ^ mk3[c >> 24])
+        t1 = (mk0[d >> 24] ^ mk1[d & 0xff] ^ mk2[(d >> 8) & 0xff] ^ mk3[(d >> 16) & 0xff])
+        a = (((a << 1) & 0xffffffff) | (a >> 31)) ^ ((t0 + t1 + k8) & 0xffffffff)
+        b ^= (t0 + 2 * t1 + k9) & 0xffffffff
+        b = (b >> 1) | ((b << 31) & 0xffffffff)
+
+        in_blk[i] = c ^ k0 ^ v0
+        in_blk[i + 1] = d ^ k1 ^ v1
+        in_blk[i + 2] = a ^ k2 ^ v2
+        in_blk[i + 3] = b ^ k3 ^ v3
+        v0, v1, v2, v3 = x0, x1, x2, x3
+    return (v0, v1, v2, v3)
@@ -17,7 +17,7 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 #
 
-import operator
+import struct
 from . import twofish
 
 
@@ -31,7 +31,16 @@ class TwofishCBC:
         """
         self.twofish = twofish.Twofish()
         self.twofish.set_key(key)
-        self.state = init_vec
+        self.reset(init_vec)
+
+    def reset(self, init_vec=0):
+        """
+        Restart chaining from the given initialization vector, keeping the key schedule.
+        """
+        if not init_vec:
+            init_vec = bytes(16)
+        # chaining state, kept as four little-endian 32-bit words
+        self.state = struct.unpack("<4L", init_vec)
 
     def encrypt(self, plaintext):
         """
@@ -39,13 +48,10 @@ class TwofishCBC:
         """
         if len(plaintext) % 16:
             raise RuntimeError("Twofish ciphertext length must be a multiple of 16")
-        ciphertext = b""
-        while len(plaintext) >= 16:
-            block = self.twofish.encrypt(self._xor_block(plaintext[0:16], self.state))
-            ciphertext += block
-            plaintext = plaintext[16:]
-            self.state = block
-        return ciphertext
+        fmt = "<%dL" % (len(plaintext) // 4)
+        words = list(struct.unpack(fmt, plaintext))
+        self.state = twofish.encrypt_cbc(self.twofish.context, words, self.state)
+        return struct.pack(fmt, *words)
 
     def decrypt(self, ciphertext):
         """
@@ -53,36 +59,7 @@ class TwofishCBC:
         """
         if len(ciphertext) % 16:
             raise RuntimeError("Twofish ciphertext length must be a multiple of 16")
-        plaintext = b""
-        while len(ciphertext) >= 16:
-            block = ciphertext[0:16]
-            plaintext += self._xor_block(self.twofish.decrypt(block), self.state)
-            ciphertext = ciphertext[16:]
-            self.state = block
-        return plaintext
-
-    @staticmethod
-    def _xor_block(text1, text2):
-        """
-        Return the bitwise xor of two arbitrary-length blocks of data
-        """
-        return b"".join(
-                   map(
-                       lambda c1, c2: bytes([operator.xor(c1, c2)]),
-                       text1,
-                       text2
-                       )
-                   )
-
-
-def test_twofish_cbc():
-    __testkey = b"Now Testing Crypto-Functions...."
-    __testivc = b"Initialization V"
-    __testenc = b"Passing nonsense through crypt-API, will then do assertion check"
-    __testdec = b"\x38\xd1\xe3\xb1\xe6\x0d\x41\xa7\xe7\xba\xf1\xeb\x34\x4b\xc3\xdb\x88\x38\xf5\x47\x41\x15\x3f\x26\xa4\x2d\x53\xd8\xd2\x80\x25\x0a\xf3\xe4\xbe\xe4\xba\xe1\xeb\x18\x18\x66\x8a\xa6\xe2\xd0\x2b\x6e\x62\x36\x91\xf7\x72\x28\x5e\xc6\x40\x89\x70\x91\x2c\x35\x71\x39"
-    assert TwofishCBC(__testkey, __testivc).decrypt(__testenc) == __testdec
-    assert TwofishCBC(__testkey, __testivc).encrypt(__testdec) == __testenc
-
-
-test_twofish_cbc()
-
+        fmt = "<%dL" % (len(ciphertext) // 4)
+        words = list(struct.unpack(fmt, ciphertext))
+        self.state = twofish.decrypt_cbc(self.twofish.context, words, self.state)
+        return struct.pack(fmt, *words)
@@ -0,0 +1,149 @@
+#
+# Loxodo -- Password Safe V3 compatible Password Vault
+# Copyright (C) 2008 Christoph Sommer <mail@christoph-sommer.de>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+Twofish ECB/CBC modes on top of natively implemented Twofish block ciphers.
+
+Each loader returns a pair of (TwofishECB, TwofishCBC) classes with the same
+interface as the pure Python ones, or raises ImportError if the underlying
+library is not installed.
+"""
+
+# pylint: disable=import-outside-toplevel
+
+
+def _xor16(text1, text2):
+    """
+    Return the bitwise xor of two 16-byte blocks
+    """
+    return (int.from_bytes(text1, "little") ^ int.from_bytes(text2, "little")).to_bytes(16, "little")
+
+
+def _make_modes(new_cipher):
+    """
+    Build ECB and CBC mode classes around new_cipher(key), which must return a
+    pair of functions en-/de-crypting any number of whole 16-byte blocks.
+    """
+    class TwofishECB:
+        """
+        Electronic codebook (ECB) Twofish operation mode.
+        """
+        def __init__(self, key):
+            (self._encrypt, self._decrypt) = new_cipher(bytes(key))
+
+        def encrypt(self, plaintext):
+            """
+            Encrypt the given string using Twofish ECB.
+            """
+            if len(plaintext) % 16:
+                raise RuntimeError("Twofish plaintext length must be a multiple of 16")
+            return self._encrypt(bytes(plaintext))
+
+        def decrypt(self, ciphertext):
+            """
+            Decrypt the given string using Twofish ECB.
+            """
+            if len(ciphertext) % 16:
+                raise RuntimeError("Twofish ciphertext length must be a multiple of 16")
+            return self._decrypt(bytes(ciphertext))
+
+    class TwofishCBC:
+        """
+        Cipher-block chaining (CBC) Twofish operation mode.
+        """
+        def __init__(self, key, init_vec=0):
+            (self._encrypt, self._decrypt) = new_cipher(bytes(key))
+            self.reset(init_vec)
+
+        def reset(self, init_vec=0):
+            """
+            Restart chaining from the given initialization vector, keeping the key schedule.
+            """
+            if not init_vec:
+                init_vec = bytes(16)
+            self.state = bytes(init_vec)
+
+        def encrypt(self, plaintext):
+            """
+            Encrypt the given string using Twofish CBC.
+            """
+            if len(plaintext) % 16:
+                raise RuntimeError("Twofish ciphertext length must be a multiple of 16")
+            plaintext = memoryview(plaintext)
+            ciphertext = bytearray(len(plaintext))
+            state = self.state
+            for i in range(0, len(plaintext), 16):
+                state = self._encrypt(_xor16(plaintext[i:i+16], state))
+                ciphertext[i:i+16] = state
+            self.state = state
+            return bytes(ciphertext)
+
+        def decrypt(self, ciphertext):
+            """
+            Decrypt the given string using Twofish CBC.
+            """
+            if len(ciphertext) % 16:
+                raise RuntimeError("Twofish ciphertext length must be a multiple of 16")
+            if not ciphertext:
+                return b""
+            ciphertext = bytes(ciphertext)
+            chain = self.state + ciphertext[:-16]
+            self.state = ciphertext[-16:]
+            plaintext = self._decrypt(ciphertext)
+            return (int.from_bytes(plaintext, "little") ^ int.from_bytes(chain, "little")).to_bytes(len(plaintext), "little")
+
+    return (TwofishECB, TwofishCBC)
+
+
+def load_botan():
+    """
+    Twofish from the Botan library (botan3 or botan2 Python bindings).
+    """
+    try:
+        import botan3 as botan
+    except ImportError:
+        import botan2 as botan
+
+    def new_cipher(key):
+        cipher = botan.BlockCipher("Twofish")
+        cipher.set_key(key)
+        # the bindings may return ctypes buffers
+        return (lambda data: bytes(cipher.encrypt(data)), lambda data: bytes(cipher.decrypt(data)))
+
+    return _make_modes(new_cipher)
+
+
+def load_twofish():
+    """
+    Twofish from the "twofish" C extension (https://pypi.org/project/twofish/).
+    """
+    import twofish
+
+    def new_cipher(key):
+        cipher = twofish.Twofish(key)
+
+        def encrypt(data):
+            return b"".join([cipher.encrypt(data[i:i+16]) for i in range(0, len(data), 16)])
+
+        def decrypt(data):
+            return b"".join([cipher.decrypt(data[i:i+16]) for i in range(0, len(data), 16)])
+
+        return (encrypt, decrypt)
+
+    return _make_modes(new_cipher)
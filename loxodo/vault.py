@@ -19,17 +19,18 @@
 
 # pylint: disable=too-many-instance-attributes
 
+import copy
 import hashlib
 import struct
-from hmac import HMAC
+from hmac import HMAC, compare_digest
 import os
 import tempfile
 import time
 import uuid
 import secrets
 
-from loxodo.twofish.twofish_ecb import TwofishECB
-from loxodo.twofish.twofish_cbc import TwofishCBC
+from loxodo.twofish import TwofishECB, TwofishCBC
+from loxodo.keystretch import stretch_password as _stretch_password
 
 
 class BadPasswordError(RuntimeError):
@@ -48,177 +49,288 @@ class Field:
     """
     Contains the raw, on-disk representation of a record's field.
     """
+    __slots__ = ("raw_type", "raw_value")
+
     def __init__(self, raw_type, raw_value):
         self.raw_type = raw_type
         self.raw_value = raw_value
-        self.raw_len = len(raw_value)
+
+    @property
+    def raw_len(self):
+        return len(self.raw_value)
+
+
+def _decode_text(raw_value):
+    return raw_value.decode('utf_8', 'replace')
+
+
+def _encode_text(value):
+    return value.encode('utf_8', 'replace')
+
+
+def _decode_uuid(raw_value):
+    return uuid.UUID(bytes_le=raw_value)
+
+
+def _encode_uuid(value):
+    return value.bytes_le
+
+
+def _decode_time(raw_value):
+    if len(raw_value) == 4:
+        return struct.unpack("<L", raw_value)[0]
+    # written as hexadecimal ASCII before PasswordSafe 3.09
+    if len(raw_value) == 8:
+        try:
+            return int(raw_value, 16)
+        except ValueError:
+            pass
+    return 0
+
+
+def _encode_time(value):
+    return struct.pack("<L", value)
 
 
-class Header:
+def _int_codec(size):
     """
-    Contains the fields of a Vault header.
+    Return a codec for little-endian unsigned integers of the given size.
+    """
+    def decode(raw_value):
+        if len(raw_value) != size:
+            return 0
+        return int.from_bytes(raw_value, "little")
+
+    def encode(value):
+        return value.to_bytes(size, "little")
+
+    return (decode, encode, 0)
+
+
+# (decode, encode, value of a missing field) for each data type of formatV3
+_TEXT = (_decode_text, _encode_text, "")
+_UUID = (_decode_uuid, _encode_uuid, None)
+_TIME = (_decode_time, _encode_time, 0)
+_BINARY = (bytes, bytes, b"")
+_UINT8 = _int_codec(1)
+_UINT16 = _int_codec(2)
+_UINT32 = _int_codec(4)
+
+
+class _FieldContainer:
     """
+    Raw fields keyed by type, each decoded on first access through the _FieldProperty
+    declared for it by the subclass.
+    """
+    __slots__ = ("raw_fields", "_decoded")
+
     def __init__(self):
         self.raw_fields = {}
+        self._decoded = {}
 
     def add_raw_field(self, raw_field):
         self.raw_fields[raw_field.raw_type] = raw_field
+        self._decoded.pop(raw_field.raw_type, None)
+
+    def _changing(self, raw_types):
+        """
+        Called before the fields of the given types are changed through their properties or merge().
+        """
 
+    def _touch(self, raw_types):
+        """
+        Called after the fields of the given types were changed through their properties or merge().
+        """
 
-def _read_field_tlv(filehandle, cipher) -> Field:
+    def mark_modified(self):
+        pass
+
+
+class _FieldProperty(property):
     """
-    Return one field of a vault record by reading from the given file handle.
+    Property of a _FieldContainer giving access to the field of the given raw type, decoded
+    on first access.  Setting it to None removes the field, setting it to its current value
+    does nothing.  Unless told otherwise, a change counts as a modification of the container.
     """
-    data = filehandle.read(16)
-    if not data or len(data) < 16:
-        raise VaultFormatError("EOF encountered when parsing record field")
-    if data == b"PWS3-EOFPWS3-EOF":
-        return None
-    data = cipher.decrypt(data)
-    raw_len = struct.unpack("<L", data[0:4])[0]
-    raw_type = struct.unpack("<B", bytes([data[4]]))[0]
-    #   data = [int]
-    raw_value = data[5:]
-    if raw_len > 11:
-        for _ in range((raw_len+4)//16):
-            data = filehandle.read(16)
-            if not data or len(data) < 16:
-                raise VaultFormatError("EOF encountered when parsing record field")
-            raw_value += cipher.decrypt(data)
-    raw_value = raw_value[:raw_len]
-    return Field(raw_type, raw_value)
-
-
-class Record:
+    def __init__(self, raw_type, codec, modifying=True):
+        (decode, encode, default) = codec
+
+        def getter(container):
+            try:
+                return container._decoded[raw_type]  # pylint: disable=protected-access
+            except KeyError:
+                pass
+            raw_field = container.raw_fields.get(raw_type)
+            value = default if raw_field is None else decode(raw_field.raw_value)
+            container._decoded[raw_type] = value  # pylint: disable=protected-access
+            return value
+
+        def setter(container, value):
+            if value is None:
+                if raw_type not in container.raw_fields:
+                    return
+                container._changing((raw_type,))  # pylint: disable=protected-access
+                del container.raw_fields[raw_type]
+                container._decoded.pop(raw_type, None)  # pylint: disable=protected-access
+            else:
+                if raw_type in container.raw_fields and getter(container) == value:
+                    return
+                container._changing((raw_type,))  # pylint: disable=protected-access
+                container.raw_fields[raw_type] = Field(raw_type, encode(value))
+                container._decoded[raw_type] = value  # pylint: disable=protected-access
+            container._touch((raw_type,))  # pylint: disable=protected-access
+            if modifying:
+                container.mark_modified()
+
+        property.__init__(self, getter, setter)
+        self.raw_type = raw_type
+        self.codec = codec
+        self.modifying = modifying
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+
+def _field_table(cls):
     """
-    Contains the fields of an individual password record.
+    Return {raw type: (attribute, codec)} for the _FieldProperty attributes of cls.
     """
-    def __init__(self):
-        self.raw_fields = {}
-        self._uuid = None
-        self._group: str = ""
-        self._title: str = ""
-        self._user = ""
-        self._notes = ""
-        self._passwd = ""
-        self._last_mod: int = 0
-        self._url = ""
-
-    @staticmethod
-    def create():
-        record = Record()
-        record.uuid = uuid.uuid4()
-        record.last_mod = int(time.time())
-        return record
+    fields = [value for value in vars(cls).values() if isinstance(value, _FieldProperty)]
+    return {field.raw_type: (field.name, field.codec) for field in sorted(fields, key=lambda f: f.raw_type)}
 
-    def add_raw_field(self, raw_field):
-        self.raw_fields[raw_field.raw_type] = raw_field
-        if raw_field.raw_type == 0x01:
-            self._uuid = uuid.UUID(bytes_le=raw_field.raw_value)
-        if raw_field.raw_type == 0x02:
-            self._group = raw_field.raw_value.decode('utf_8', 'replace')
-        if raw_field.raw_type == 0x03:
-            self._title = raw_field.raw_value.decode('utf_8', 'replace')
-        if raw_field.raw_type == 0x04:
-            self._user = raw_field.raw_value.decode('utf_8', 'replace')
-        if raw_field.raw_type == 0x05:
-            self._notes = raw_field.raw_value.decode('utf_8', 'replace')
-        if raw_field.raw_type == 0x06:
-            self._passwd = raw_field.raw_value.decode('utf_8', 'replace')
-        if raw_field.raw_type == 0x0c and raw_field.raw_len == 4:
-            self._last_mod = struct.unpack("<L", raw_field.raw_value)[0]
-        if raw_field.raw_type == 0x0d:
-            self._url = raw_field.raw_value.decode('utf_8', 'replace')
 
-    def mark_modified(self):
-        self.last_mod = int(time.time())
+class Header(_FieldContainer):
+    """
+    Contains the fields of a Vault header.
+    """
+    __slots__ = ()
 
-    @property
-    def uuid(self):
-        return self._uuid
+    # header field types of formatV3 (section 3.2)
+    version = _FieldProperty(0x00, _UINT16)
+    uuid = _FieldProperty(0x01, _UUID)
+    preferences = _FieldProperty(0x02, _TEXT)
+    tree_display_status = _FieldProperty(0x03, _TEXT)
+    last_save = _FieldProperty(0x04, _TIME)
+    last_save_who = _FieldProperty(0x05, _TEXT)
+    last_save_what = _FieldProperty(0x06, _TEXT)
+    last_save_user = _FieldProperty(0x07, _TEXT)
+    last_save_host = _FieldProperty(0x08, _TEXT)
+    name = _FieldProperty(0x09, _TEXT)
+    description = _FieldProperty(0x0a, _TEXT)
+    filters = _FieldProperty(0x0b, _TEXT)
+    recently_used = _FieldProperty(0x0f, _TEXT)
+    named_password_policies = _FieldProperty(0x10, _TEXT)
+    empty_groups = _FieldProperty(0x11, _TEXT)
+    yubico = _FieldProperty(0x12, _TEXT)
+    last_master_password_change = _FieldProperty(0x13, _TIME)
 
-    @uuid.setter
-    def uuid(self, value):
-        self._uuid = value
-        raw_id = 0x01
-        self.raw_fields[raw_id] = Field(raw_id, value.bytes_le)
-        self.mark_modified()
 
-    @property
-    def group(self):
-        return self._group
+# raw type -> (attribute, codec) of all header fields
+HEADER_FIELDS = _field_table(Header)
 
-    @group.setter
-    def group(self, value):
-        self._group = value
-        raw_id = 0x02
-        self.raw_fields[raw_id] = Field(raw_id, value.encode('utf_8', 'replace'))
-        self.mark_modified()
 
-    @property
-    def title(self):
-        return self._title
+_EOF_MARKER = b"PWS3-EOFPWS3-EOF"
+_TLV_HEADER = struct.Struct("<LB")
 
-    @title.setter
-    def title(self, value):
-        self._title = value
-        raw_id = 0x03
-        self.raw_fields[raw_id] = Field(raw_id, value.encode('utf_8', 'replace'))
-        self.mark_modified()
+# bytes decrypted and records parsed between two calls of a progress callback
+_PROGRESS_BYTES = 1 << 16
+_PROGRESS_RECORDS = 256
 
-    @property
-    def user(self):
-        return self._user
 
-    @user.setter
-    def user(self, value):
-        self._user = value
-        raw_id = 0x04
-        self.raw_fields[raw_id] = Field(raw_id, value.encode('utf_8', 'replace'))
-        self.mark_modified()
+def _split_body(data):
+    """
+    Split everything following the IV into the encrypted fields and the HMAC.
+    """
+    # The EOF marker is normally followed by nothing but the HMAC
+    end = len(data) - 48
+    if end >= 0 and end % 16 == 0 and data[end:end+16] == _EOF_MARKER:
+        return (data[:end], data[end+16:])
+    for end in range(0, len(data) - 15, 16):
+        if data[end:end+16] == _EOF_MARKER:
+            return (data[:end], data[end+16:end+48])
+    raise VaultFormatError("EOF encountered when parsing record field")
 
-    @property
-    def notes(self):
-        return self._notes
 
-    @notes.setter
-    def notes(self, value):
-        self._notes = value
-        raw_id = 0x05
-        self.raw_fields[raw_id] = Field(raw_id, value.encode('utf_8', 'replace'))
-        self.mark_modified()
+def _iter_field_tlvs(plaintext):
+    """
+    Yield (field, offset of the following TLV) for the given decrypted stream of TLV blocks.
+    """
+    view = memoryview(plaintext)
+    pos = 0
+    end = len(view)
+    while pos < end:
+        (raw_len, raw_type) = _TLV_HEADER.unpack_from(view, pos)
+        value_start = pos + 5
+        if value_start + raw_len > end:
+            raise VaultFormatError("EOF encountered when parsing record field")
+        # each TLV is padded to a multiple of 16 bytes
+        pos += (5 + raw_len + 15) & ~15
+        yield (Field(raw_type, bytes(view[value_start:value_start + raw_len])), pos)
+
+
+class Record(_FieldContainer):
+    """
+    Contains the fields of an individual password record.
 
-    @property
-    def passwd(self):
-        return self._passwd
+    Only the raw fields are kept as read from disk; each property is decoded on first access.
+    Changes of a Record that belongs to a Vault are reported to the Vault's ChangeJournal.
+    """
+    __slots__ = ("_vault",)
+
+    # record field types of formatV3 (section 3.3)
+    uuid = _FieldProperty(0x01, _UUID)
+    group = _FieldProperty(0x02, _TEXT)
+    title = _FieldProperty(0x03, _TEXT)
+    user = _FieldProperty(0x04, _TEXT)
+    notes = _FieldProperty(0x05, _TEXT)
+    passwd = _FieldProperty(0x06, _TEXT)
+    creation_time = _FieldProperty(0x07, _TIME)
+    passwd_mod_time = _FieldProperty(0x08, _TIME)
+    last_access_time = _FieldProperty(0x09, _TIME, modifying=False)
+    passwd_expiry_time = _FieldProperty(0x0a, _TIME)
+    last_mod = _FieldProperty(0x0c, _TIME, modifying=False)
+    url = _FieldProperty(0x0d, _TEXT)
+    autotype = _FieldProperty(0x0e, _TEXT)
+    passwd_history = _FieldProperty(0x0f, _TEXT)
+    passwd_policy = _FieldProperty(0x10, _TEXT)
+    passwd_expiry_interval = _FieldProperty(0x11, _UINT32)
+    run_command = _FieldProperty(0x12, _TEXT)
+    double_click_action = _FieldProperty(0x13, _UINT16)
+    email = _FieldProperty(0x14, _TEXT)
+    protected = _FieldProperty(0x15, _UINT8)
+    own_symbols = _FieldProperty(0x16, _TEXT)
+    shift_double_click_action = _FieldProperty(0x17, _UINT16)
+    passwd_policy_name = _FieldProperty(0x18, _TEXT)
+    keyboard_shortcut = _FieldProperty(0x19, _UINT32)
+    two_factor_key = _FieldProperty(0x1b, _BINARY)
+    cc_number = _FieldProperty(0x1c, _TEXT)
+    cc_expiration = _FieldProperty(0x1d, _TEXT)
+    cc_verif_value = _FieldProperty(0x1e, _TEXT)
+    cc_pin = _FieldProperty(0x1f, _TEXT)
+    qr_code = _FieldProperty(0x20, _TEXT)
 
-    @passwd.setter
-    def passwd(self, value):
-        self._passwd = value
-        raw_id = 0x06
-        self.raw_fields[raw_id] = Field(raw_id, value.encode('utf_8', 'replace'))
-        self.mark_modified()
+    def __init__(self):
+        _FieldContainer.__init__(self)
+        self._vault = None
 
-    @property
-    def last_mod(self) -> int:
-        return self._last_mod
+    @staticmethod
+    def create():
+        record = Record()
+        record.uuid = uuid.uuid4()
+        record.last_mod = int(time.time())
+        return record
 
-    @last_mod.setter
-    def last_mod(self, value: int):
-        self._last_mod = value
-        raw_id = 0x0c
-        self.raw_fields[raw_id] = Field(raw_id, struct.pack("<L", value))
+    def _changing(self, raw_types):
+        if self._vault is not None:
+            self._vault._record_changing(self, raw_types)  # pylint: disable=protected-access
 
-    @property
-    def url(self):
-        return self._url
+    def _touch(self, raw_types):
+        if self._vault is not None:
+            self._vault._record_changed(self, raw_types)  # pylint: disable=protected-access
 
-    @url.setter
-    def url(self, value):
-        self._url = value
-        raw_id = 0x0d
-        self.raw_fields[raw_id] = Field(raw_id, value.encode('utf_8', 'replace'))
-        self.mark_modified()
+    def mark_modified(self):
+        self.last_mod = int(time.time())
 
     def is_corresponding(self, record):
         """
@@ -238,12 +350,108 @@ class Record:
         """
         Merge in fields from another Record, replacing existing ones
         """
-        self.raw_fields = {}
-        for field in record.raw_fields.values():
-            self.add_raw_field(field)
+        new_fields = dict(record.raw_fields)
+        changed = [raw_type for raw_type in set(self.raw_fields).union(new_fields)
+                   if self.raw_fields.get(raw_type) is not new_fields.get(raw_type)]
+        if not changed:
+            return
+        self._changing(changed)
+        self.raw_fields = new_fields
+        self._decoded = {}
+        self._touch(changed)
 
     def for_cmp(self):
-        return self._group + self._title
+        return self.group + self.title
+
+
+# raw type -> (attribute, codec) of all record fields
+RECORD_FIELDS = _field_table(Record)
+
+
+def _removed_key(record):
+    """
+    Return what identifies a removed Record in a ChangeJournal: its UUID or, lacking one,
+    its (group, title).
+    """
+    if record.uuid is not None:
+        return record.uuid
+    return (record.group, record.title)
+
+
+class ChangeJournal:
+    """
+    Records added to, removed from or changed in a Vault since the journal was last cleared.
+
+    Like any observer of a Vault (see Vault.add_observer()), it is told about each change
+    through record_added(), record_removed() and field_changed().
+
+    added maps each new Record to the serial number of its last change; changed maps each
+    other Record to {field type: serial number of its last change}.  Removed Records are
+    not kept, only their UUIDs (or (group, title) if they had none) as keys of removed.
+    Serial numbers allow clearing just what was recorded up to a point, see clear().
+    """
+    __slots__ = ("added", "removed", "changed", "serial")
+
+    def __init__(self):
+        self.added = {}
+        self.removed = {}
+        self.changed = {}
+        self.serial = 0
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def _next_serial(self):
+        self.serial += 1
+        return self.serial
+
+    def record_added(self, record):
+        serial = self._next_serial()
+        if self.removed.pop(_removed_key(record), None) is not None:
+            # back again, possibly with different fields
+            self.changed.setdefault(record, {}).update(dict.fromkeys(record.raw_fields, serial))
+        else:
+            self.added[record] = serial
+
+    def record_removed(self, record):
+        serial = self._next_serial()
+        self.changed.pop(record, None)
+        if self.added.pop(record, None) is None:
+            self.removed[_removed_key(record)] = serial
+
+    def field_changed(self, record, raw_type):
+        serial = self._next_serial()
+        if record in self.added:
+            self.added[record] = serial
+        else:
+            self.changed.setdefault(record, {})[raw_type] = serial
+
+    def uuids(self):
+        """
+        Return the set of UUIDs of all Records in the journal.
+        """
+        uuids = {record.uuid for records in (self.added, self.changed)
+                 for record in records if record.uuid is not None}
+        uuids.update(key for key in self.removed if not isinstance(key, tuple))
+        return uuids
+
+    def clear(self, serial=None):
+        """
+        Forget all changes, or only those recorded up to the given serial number.
+        """
+        if serial is None:
+            self.added.clear()
+            self.removed.clear()
+            self.changed.clear()
+            return
+        for entries in (self.added, self.removed):
+            for key in [key for (key, last) in entries.items() if last <= serial]:
+                del entries[key]
+        for (record, fields) in list(self.changed.items()):
+            for raw_type in [raw_type for (raw_type, last) in fields.items() if last <= serial]:
+                del fields[raw_type]
+            if not fields:
+                del self.changed[record]
 
 
 def duplicate_record(record2: Record) -> Record:
@@ -259,45 +467,206 @@ def _urandom(count):
     return secrets.token_bytes(count)
 
 
-def _write_field_tlv(filehandle, cipher, field):
+def _pack_field_tlvs(fields):
     """
-    Write one field of a vault record using the given file handle.
+    Return the TLV blocks of the given fields, each padded to a 16-byte boundary.
     """
-    if field is None:
-        filehandle.write(b"PWS3-EOFPWS3-EOF")
-        return
+    size = 0
+    for field in fields:
+        size += (5 + len(field.raw_value) + 15) & ~15
+
+    # start out with random bytes so the padding needs no extra work
+    data = bytearray(_urandom(size))
+    pos = 0
+    for field in fields:
+        raw_len = len(field.raw_value)
+        _TLV_HEADER.pack_into(data, pos, raw_len, field.raw_type)
+        data[pos + 5:pos + 5 + raw_len] = field.raw_value
+        pos += (5 + raw_len + 15) & ~15
+    return data
+
+
+# the time of last save in the header is refreshed at least this often (in seconds),
+# even though changing the header means re-encrypting all records
+_HEADER_STAMP_INTERVAL = 600
+
+# "what performed last save" as written by this program
+_LAST_SAVE_WHAT = "Loxodo 0.0-git"
+
+
+class _SavedStream:
+    """
+    The encrypted fields of a Vault as last read or written.
+
+    segments holds (Fields, offset of the segment's end) for the header and then each record,
+    with Fields being None for segments that cannot be re-used.  No decrypted copy is kept:
+    the Fields of a re-used segment are all that is needed to compute the HMAC.
+    """
+    __slots__ = ("keys", "init_vec", "ciphertext", "segments")
+
+    def __init__(self, keys, init_vec, ciphertext, segments):
+        self.keys = keys
+        self.init_vec = init_vec
+        self.ciphertext = ciphertext
+        self.segments = segments
+
+
+def _segment_fields(raw_fields, count):
+    """
+    Return the Fields of a segment that was read with count fields, or None if some were
+    overwritten by a later field of the same type.
+    """
+    if len(raw_fields) != count:
+        return None
+    return tuple(raw_fields.values())
+
+
+def _unchanged(raw_fields, fields):
+    """
+    Return True if raw_fields still holds exactly the given Field objects, in the same order.
+    """
+    if fields is None or len(raw_fields) != len(fields):
+        return False
+    for (field, saved_field) in zip(raw_fields.values(), fields):
+        if field is not saved_field:
+            return False
+    return True
+
+
+# lowest ITER allowed by formatV3
+MIN_ITERATIONS = 2048
+
+_calibrated_iterations = {}
+
 
-    assert len(field.raw_value) == field.raw_len
+def calibrate_iterations(target_time=0.25, minimum=MIN_ITERATIONS):
+    """
+    Return the ITER value that makes stretching a password take about target_time seconds on this machine.
 
-    raw_len = struct.pack("<L", field.raw_len)
-    raw_type = struct.pack("<B", field.raw_type)
-    raw_value = field.raw_value
+    The result is rounded to two significant digits, so that it does not change with every
+    measurement, and cached for the lifetime of the interpreter.
+    """
+    if target_time in _calibrated_iterations:
+        return _calibrated_iterations[target_time]
+
+    # time increasing numbers of iterations until the measurement is long enough to be meaningful
+    iterations = minimum
+    while True:
+        start = time.perf_counter()
+        _stretch_password(b"calibration", bytes(32), iterations)
+        elapsed = time.perf_counter() - start
+        if elapsed >= 0.05:
+            break
+        iterations *= 2
+
+    result = int(iterations * target_time / elapsed)
+    digits = len(str(result)) - 2
+    if digits > 0:
+        result = round(result, -digits)
+    result = max(minimum, result)
+
+    _calibrated_iterations[target_time] = result
+    return result
+
+
+class DerivedKeys:
+    """
+    Key material derived from a Vault password: H(P'), K, L and a CBC cipher
+    keyed with K.
 
-    # Assemble TLV block and pad to 16-byte boundary
-    data = raw_len + raw_type + raw_value
-    if len(data) % 16 != 0:
-        pad_count = 16 - (len(data) % 16)
-        data += _urandom(pad_count)
+    It is valid for one combination of password, SALT, ITER and B1-B4 only,
+    see matches().  Keeping it around while a Vault is open saves stretching
+    the password again on every save.
+    """
+    def __init__(self, password, salt, iterations, b1_b4, stretched_password=None):
+        if stretched_password is None:
+            stretched_password = _stretch_password(password, salt, iterations)
+        self._password = bytearray(password)
+        self._salt = salt
+        self._iterations = iterations
+        self._b1_b4 = b1_b4
+        self.sha_ps = hashlib.sha256(stretched_password).digest()
 
-    data = cipher.encrypt(data)
+        cipher = TwofishECB(stretched_password)
+        self.key_k = bytearray(cipher.decrypt(b1_b4[:32]))
+        self.key_l = bytearray(cipher.decrypt(b1_b4[32:]))
+        self._cbc = None
 
-    filehandle.write(data)
+    def matches(self, password, salt, iterations, b1_b4):
+        """
+        Return True if these keys were derived from the given values.
+        """
+        return (self._cbc is not False and
+                self._salt == salt and
+                self._iterations == iterations and
+                self._b1_b4 == b1_b4 and
+                compare_digest(bytes(self._password), password))
+
+    def hmac(self):
+        """
+        Return a new HMAC object keyed with L.
+        """
+        return HMAC(bytes(self.key_l), b"", hashlib.sha256)
+
+    def cbc(self, init_vec):
+        """
+        Return the CBC cipher keyed with K, restarted at the given IV.
+        """
+        if self._cbc is None:
+            self._cbc = TwofishCBC(bytes(self.key_k), init_vec)
+        else:
+            self._cbc.reset(init_vec)
+        return self._cbc
+
+    def wipe(self):
+        """
+        Overwrite the password and keys held by this object and make it unusable.
+        """
+        for buf in (self._password, self.key_k, self.key_l):
+            buf[:] = bytes(len(buf))
+        self._cbc = False
 
 
-def _stretch_password(password, salt, iterations):
+# uuid, group and title: the fields the Records of a Vault are indexed by
+_INDEXED_FIELDS = frozenset((0x01, 0x02, 0x03))
+
+
+def _index_add(index, key, record):
+    """
+    Add a Record to an index mapping each key to a Record or, for keys shared by several Records, a list of them.
+    """
+    entry = index.get(key)
+    if entry is None:
+        index[key] = record
+    elif isinstance(entry, list):
+        entry.append(record)
+    else:
+        index[key] = [entry, record]
+
+
+def _index_remove(index, key, record):
     """
-    Generate the SHA-256 value of a password after several rounds of stretching.
+    Remove a Record from an index filled by _index_add().
+    """
+    entry = index[key]
+    if entry is record:
+        del index[key]
+        return
+    entry.remove(record)
+    if len(entry) == 1:
+        index[key] = entry[0]
 
-    The algorithm is described in the following paper:
-    [KEYSTRETCH Section 4.1] http://www.schneier.com/paper-low-entropy.pdf
+
+def _index_get(index, key):
+    """
+    Return the Records of an index filled by _index_add() having the given key.
     """
-    sha = hashlib.sha256()
-    sha.update(password)
-    sha.update(salt)
-    stretched_password = sha.digest()
-    for dummy in range(iterations):
-        stretched_password = hashlib.sha256(stretched_password).digest()
-    return stretched_password
+    entry = index.get(key)
+    if entry is None:
+        return ()
+    if isinstance(entry, list):
+        return entry
+    return (entry,)
 
 
 class Vault:
@@ -306,8 +675,12 @@ class Vault:
 
     The on-disk represenation of the Vault is described in the following file:
     http://passwordsafe.svn.sourceforge.net/viewvc/passwordsafe/trunk/pwsafe/pwsafe/docs/formatV3.txt?revision=2139
+
+    While reading a file, progress(stage, done, total) is called now and then if given:
+    stage "stretch" counts ITER rounds, "decrypt" bytes and "records" parsed Records
+    (with a total of None).  Any exception it raises aborts reading.
     """
-    def __init__(self, password, filename=None):
+    def __init__(self, password, filename=None, iterations=None, progress=None):
         self.f_tag = None
         self.f_salt = None
         self.f_iter = None
@@ -318,43 +691,49 @@ class Vault:
         self.f_b4 = None
         self.f_iv = None
         self.f_hmac = None
+        self._keys = None
+        self._saved = None
         self.header = Header()
         self.records = []
+        # changes not yet written to disk
+        self.journal = ChangeJournal()
+        self._observers = [self.journal]
+        # for snapshots: the journal's serial number when the snapshot was taken
+        self._snapshot_serial = None
+        self._positions = {}
+        self._by_uuid = {}
+        self._by_name = {}
         if not filename:
-            self._create_empty(password)
+            self._create_empty(password, max(MIN_ITERATIONS, iterations or 0))
         else:
-            self._read_from_file(filename, password)
+            self._read_from_file(filename, password, progress)
 
     @staticmethod
-    def create(password, filename):
-        vault = Vault(password)
+    def create(password, filename, iterations=None):
+        vault = Vault(password, iterations=iterations)
         vault.write_to_file(filename, password)
 
-    def _create_empty(self, password: bytes):
-        self.f_tag = 'PWS3'
+    def _create_empty(self, password: bytes, iterations):
+        self.f_tag = b'PWS3'
         self.f_salt = _urandom(32)
-        self.f_iter = 2048
+        self.f_iter = iterations
         stretched_password = _stretch_password(password, self.f_salt, self.f_iter)
-        self.f_sha_ps = hashlib.sha256(stretched_password).digest()
 
         cipher = TwofishECB(stretched_password)
         self.f_b1 = cipher.encrypt(_urandom(16))
         self.f_b2 = cipher.encrypt(_urandom(16))
         self.f_b3 = cipher.encrypt(_urandom(16))
         self.f_b4 = cipher.encrypt(_urandom(16))
-        key_k = cipher.decrypt(self.f_b1) + cipher.decrypt(self.f_b2)
-        key_l = cipher.decrypt(self.f_b3) + cipher.decrypt(self.f_b4)
+        self._keys = DerivedKeys(password, self.f_salt, self.f_iter, self._b1_b4(), stretched_password)
+        self.f_sha_ps = self._keys.sha_ps
 
         self.f_iv = _urandom(16)
 
-        hmac_checker = HMAC(key_l, b"", hashlib.sha256)
-        cipher = TwofishCBC(key_k, self.f_iv)
-
         # No records yet
 
-        self.f_hmac = hmac_checker.digest()
+        self.f_hmac = self._keys.hmac().digest()
 
-    def _read_from_stream(self, filehandle, password: bytes):
+    def _read_from_stream(self, filehandle, password: bytes, progress=None):
         # read boilerplate
 
         self.f_tag = filehandle.read(4)  # TAG: magic tag
@@ -364,7 +743,11 @@ class Vault:
         self.f_salt = filehandle.read(32)  # SALT: SHA-256 salt
         self.f_iter = struct.unpack("<L", filehandle.read(4))[0]
         #   ITER: SHA-256 keystretch iterations
-        stretched_password = _stretch_password(password, self.f_salt, self.f_iter)
+        if progress is None:
+            stretched_password = _stretch_password(password, self.f_salt, self.f_iter)
+        else:
+            stretched_password = _stretch_password(password, self.f_salt, self.f_iter,
+                                                   lambda done, total: progress("stretch", done, total))
         #   P': the stretched key
         my_sha_ps = hashlib.sha256(stretched_password).digest()
 
@@ -377,129 +760,451 @@ class Vault:
         self.f_b3 = filehandle.read(16)  # B3
         self.f_b4 = filehandle.read(16)  # B4
 
-        cipher = TwofishECB(stretched_password)
-        key_k = cipher.decrypt(self.f_b1) + cipher.decrypt(self.f_b2)
-        key_l = cipher.decrypt(self.f_b3) + cipher.decrypt(self.f_b4)
+        keys = DerivedKeys(password, self.f_salt, self.f_iter, self._b1_b4(), stretched_password)
 
         self.f_iv = filehandle.read(16)  # IV: initialization vector of Twofish CBC
 
-        hmac_checker = HMAC(key_l, b"", hashlib.sha256)
-        cipher = TwofishCBC(key_k, self.f_iv)
+        hmac_checker = keys.hmac()
+        cipher = keys.cbc(self.f_iv)
+
+        # read and decrypt all fields at once
+
+        (ciphertext, self.f_hmac) = _split_body(filehandle.read())  # HMAC: used to verify Vault's integrity
+        if progress is None:
+            plaintext = cipher.decrypt(ciphertext)
+        else:
+            plaintext = bytearray()
+            for pos in range(0, len(ciphertext), _PROGRESS_BYTES):
+                plaintext += cipher.decrypt(ciphertext[pos:pos + _PROGRESS_BYTES])
+                progress("decrypt", len(plaintext), len(ciphertext))
+        fields = _iter_field_tlvs(plaintext)
+        segments = []
 
         # read header
 
-        while True:
-            field = _read_field_tlv(filehandle, cipher)
-            if not field:
-                break
+        count = 0
+        for (field, end) in fields:
             if field.raw_type == 0xff:
+                segments.append((_segment_fields(self.header.raw_fields, count), end))
                 break
             self.header.add_raw_field(field)
             hmac_checker.update(field.raw_value)
+            count += 1
 
         # read fields
 
         current_record = Record()
-        while True:
-            field = _read_field_tlv(filehandle, cipher)
-            if not field:
-                break
+        count = 0
+        for (field, end) in fields:
             if field.raw_type == 0xff:
+                current_record._vault = self  # pylint: disable=protected-access
                 self.records.append(current_record)
+                segments.append((_segment_fields(current_record.raw_fields, count), end))
                 current_record = Record()
+                count = 0
+                if progress is not None and len(self.records) % _PROGRESS_RECORDS == 0:
+                    progress("records", len(self.records), None)
             else:
                 hmac_checker.update(field.raw_value)
                 current_record.add_raw_field(field)
-
-        # read HMAC
-
-        self.f_hmac = filehandle.read(32)  # HMAC: used to verify Vault's integrity
+                count += 1
 
         my_hmac = hmac_checker.digest()
         if self.f_hmac != my_hmac:
             raise VaultFormatError("File integrity check failed")
 
+        self._keys = keys
+        self._saved = _SavedStream(keys, self.f_iv, ciphertext, segments)
+
         #self.records.sort(key=lambda r: r._group + r._title)
         self.records.sort(key=lambda r: r.for_cmp())
+        self._reindex()
 
-    def _read_from_file(self, filename, password: bytes):
+    def _read_from_file(self, filename, password: bytes, progress=None):
         """
         Initialize all class members by loading the contents of a Vault stored in the given file.
         """
         #filehandle = open(filename, 'rb')
         with open(filename, 'rb') as filehandle:
-            self._read_from_stream(filehandle, password)
+            self._read_from_stream(filehandle, password, progress)
         #filehandle.close()
 
-    def write_to_stream(self, filehandle, password: bytes):
-        _last_save = struct.pack("<L", int(time.time()))
-        self.header.raw_fields[0x04] = Field(0x04, _last_save)
-        _what_saved = "Loxodo 0.0-git".encode("utf_8", "replace")
-        self.header.raw_fields[0x06] = Field(0x06, _what_saved)
+    def _b1_b4(self):
+        return self.f_b1 + self.f_b2 + self.f_b3 + self.f_b4
 
-        # FIXME: choose new SALT, B1-B4, IV values on each file write? Conflicting Specs!
+    def _get_keys(self, password: bytes):
+        """
+        Return the DerivedKeys for the given password, re-using the ones of the last read or write if possible.
+        """
+        if self._keys is None or not self._keys.matches(password, self.f_salt, self.f_iter, self._b1_b4()):
+            if self._keys is not None:
+                self._keys.wipe()
+            self._keys = DerivedKeys(password, self.f_salt, self.f_iter, self._b1_b4())
+        self.f_sha_ps = self._keys.sha_ps
+        return self._keys
+
+    def _index(self, record):
+        """
+        Add a Record to the UUID and (group, title) indexes.
+        """
+        if record.uuid is not None:
+            _index_add(self._by_uuid, record.uuid, record)
+        _index_add(self._by_name, (record.group, record.title), record)
 
-        # write boilerplate
+    def _unindex(self, record, record_uuid, group, title):
+        """
+        Remove a Record from the UUID and (group, title) indexes, given the values it was indexed under.
+        """
+        if record_uuid is not None:
+            _index_remove(self._by_uuid, record_uuid, record)
+        _index_remove(self._by_name, (group, title), record)
 
-        filehandle.write(self.f_tag)
-        filehandle.write(self.f_salt)
-        filehandle.write(struct.pack("<L", self.f_iter))
+    def _reindex(self):
+        """
+        Rebuild all indexes from scratch after self.records was replaced or reordered.
+        """
+        self._positions = {record: i for (i, record) in enumerate(self.records)}
+        self._by_uuid = {}
+        self._by_name = {}
+        for record in self.records:
+            self._index(record)
 
-        stretched_password = _stretch_password(password, self.f_salt, self.f_iter)
-        self.f_sha_ps = hashlib.sha256(stretched_password).digest()
-        filehandle.write(self.f_sha_ps)
+    def contains(self, record):
+        """
+        Return True if the given Record is part of this Vault.
+        """
+        return record in self._positions
 
-        filehandle.write(self.f_b1)
-        filehandle.write(self.f_b2)
-        filehandle.write(self.f_b3)
-        filehandle.write(self.f_b4)
+    def get_by_uuid(self, record_uuid):
+        """
+        Return the Record with the given UUID, or None.
+        """
+        entry = self._by_uuid.get(record_uuid)
+        if isinstance(entry, list):
+            return entry[0]
+        return entry
 
-        cipher = TwofishECB(stretched_password)
-        key_k = cipher.decrypt(self.f_b1) + cipher.decrypt(self.f_b2)
-        key_l = cipher.decrypt(self.f_b3) + cipher.decrypt(self.f_b4)
+    def get_by_name(self, group, title):
+        """
+        Return the list of Records with the given group and title.
+        """
+        return list(_index_get(self._by_name, (group, title)))
 
-        filehandle.write(self.f_iv)
+    def find_corresponding(self, record):
+        """
+        Return a Record of this Vault corresponding to the given one (of another Vault), or None.
 
-        hmac_checker = HMAC(key_l, b"", hashlib.sha256)
-        cipher = TwofishCBC(key_k, self.f_iv)
+        Records are matched by UUID or, if either has none, by group and title.
+        """
+        if record.uuid is not None:
+            my_record = self.get_by_uuid(record.uuid)
+            if my_record is not None:
+                return my_record
+        for my_record in _index_get(self._by_name, (record.group, record.title)):
+            if my_record.uuid is None or record.uuid is None:
+                return my_record
+        return None
 
-        end_of_record = Field(0xff, b"")
+    def add_record(self, record):
+        """
+        Add a Record to this Vault.
+        """
+        record._vault = self  # pylint: disable=protected-access
+        self._positions[record] = len(self.records)
+        self.records.append(record)
+        self._index(record)
+        for observer in self._observers:
+            observer.record_added(record)
+
+    def remove_record(self, record):
+        """
+        Remove a Record from this Vault.
 
-        for field in self.header.raw_fields.values():
-            _write_field_tlv(filehandle, cipher, field)
-            hmac_checker.update(field.raw_value)
-        _write_field_tlv(filehandle, cipher, end_of_record)
-        hmac_checker.update(end_of_record.raw_value)
+        The last Record takes the place of the removed one in self.records.
+        """
+        position = self._positions.pop(record)
+        last = self.records.pop()
+        if last is not record:
+            self.records[position] = last
+            self._positions[last] = position
+        self._unindex(record, record.uuid, record.group, record.title)
+        record._vault = None  # pylint: disable=protected-access
+        for observer in self._observers:
+            observer.record_removed(record)
+
+    def delete(self, record_uuid):
+        """
+        Remove the Record with the given UUID from this Vault and return it, or None if there is none.
+        """
+        record = self.get_by_uuid(record_uuid)
+        if record is not None:
+            self.remove_record(record)
+        return record
+
+    def update_record(self, record, **fields):
+        """
+        Set fields of a Record of this Vault, given by their names in RECORD_FIELDS.
+
+        Changing a Record's properties directly is tracked just as well.
+        """
+        for (name, value) in fields.items():
+            setattr(record, name, value)
+
+    def _record_changing(self, record, raw_types):
+        if not _INDEXED_FIELDS.isdisjoint(raw_types):
+            self._unindex(record, record.uuid, record.group, record.title)
+
+    def _record_changed(self, record, raw_types):
+        if not _INDEXED_FIELDS.isdisjoint(raw_types):
+            self._index(record)
+        for raw_type in raw_types:
+            for observer in self._observers:
+                observer.field_changed(record, raw_type)
+
+    def add_observer(self, observer):
+        """
+        Have observer.record_added(record), .record_removed(record) and .field_changed(record, raw_type)
+        called on every change of this Vault's Records made through add_record(), remove_record()
+        or the Records' properties.
+        """
+        self._observers.append(observer)
 
+    def remove_observer(self, observer):
+        """
+        Stop notifying an observer registered with add_observer().
+        """
+        self._observers.remove(observer)
+
+    def snapshot(self):
+        """
+        Return a copy of this Vault that can be written to disk while this one keeps being edited.
+
+        Records and header are copied down to their dicts of Fields, which are never changed in
+        place.  Key material is shared; see sync_saved() for getting back what writing changed.
+        """
+        vault = copy.copy(self)
+        vault.header = Header()
+        vault.header.raw_fields = dict(self.header.raw_fields)
+        vault.records = []
+        vault.journal = ChangeJournal()
+        vault._observers = [vault.journal]  # pylint: disable=protected-access
+        vault._snapshot_serial = self.journal.serial  # pylint: disable=protected-access
         for record in self.records:
-            for field in record.raw_fields.values():
-                _write_field_tlv(filehandle, cipher, field)
-                hmac_checker.update(field.raw_value)
-            _write_field_tlv(filehandle, cipher, end_of_record)
-            hmac_checker.update(end_of_record.raw_value)
+            copied = Record()
+            copied.raw_fields = dict(record.raw_fields)
+            vault.records.append(copied)
+        vault._reindex()  # pylint: disable=protected-access
+        return vault
+
+    def sync_saved(self, snapshot):
+        """
+        Take over the file level values (keys, SALT, ITER, time of last save, ...) of a
+        snapshot() that has been written to disk, and clear the journal of the changes it saved.
+        """
+        self.journal.clear(snapshot._snapshot_serial)  # pylint: disable=protected-access
+        self.f_salt = snapshot.f_salt
+        self.f_iter = snapshot.f_iter
+        self.f_sha_ps = snapshot.f_sha_ps
+        (self.f_b1, self.f_b2, self.f_b3, self.f_b4) = (snapshot.f_b1, snapshot.f_b2, snapshot.f_b3, snapshot.f_b4)
+        self.f_iv = snapshot.f_iv
+        self.f_hmac = snapshot.f_hmac
+        self._keys = snapshot._keys  # pylint: disable=protected-access
+        self._saved = snapshot._saved  # pylint: disable=protected-access
+        # the very same Fields, so that the next write can tell the header is unchanged
+        for raw_type in (0x04, 0x06):
+            field = snapshot.header.raw_fields.get(raw_type)
+            if field is not None:
+                self.header.add_raw_field(field)
+
+    def set_iterations(self, password: bytes, iterations):
+        """
+        Re-stretch the password with a new SALT and the given number of iterations (ITER).
+
+        The keys K and L stay the same, only their encrypted copies B1-B4 change.
+        Takes effect with the next write.
+        """
+        iterations = max(MIN_ITERATIONS, iterations)
+        old_keys = self._get_keys(password)
+        salt = _urandom(32)
+        stretched_password = _stretch_password(password, salt, iterations)
+        b1_b4 = TwofishECB(stretched_password).encrypt(bytes(old_keys.key_k) + bytes(old_keys.key_l))
+
+        self.f_salt = salt
+        self.f_iter = iterations
+        (self.f_b1, self.f_b2, self.f_b3, self.f_b4) = (b1_b4[0:16], b1_b4[16:32], b1_b4[32:48], b1_b4[48:64])
+        self._keys = DerivedKeys(password, salt, iterations, b1_b4, stretched_password)
+        self.f_sha_ps = self._keys.sha_ps
+        old_keys.wipe()
+
+    def close(self):
+        """
+        Wipe the key material kept for this Vault.
+        """
+        self._saved = None
+        if self._keys is not None:
+            self._keys.wipe()
+            self._keys = None
+
+    def _preamble(self):
+        """
+        Return the unencrypted part of the file preceding the fields.
+        """
+        return b"".join((
+            self.f_tag,
+            self.f_salt,
+            struct.pack("<L", self.f_iter),
+            self.f_sha_ps,
+            self.f_b1,
+            self.f_b2,
+            self.f_b3,
+            self.f_b4,
+            self.f_iv,
+        ))
+
+    def write_to_stream(self, filehandle, password: bytes):
+        # FIXME: choose new SALT, B1-B4, IV values on each file write? Conflicting Specs!
+        self._write_to_stream(filehandle, self._get_keys(password))
+
+    def _write_to_stream(self, filehandle, keys):
+        """
+        Write the Vault, re-encrypting only what follows the first header or record that
+        changed since the last read or write.
+
+        Returns the offset into the encrypted fields from which on they were re-encrypted.
+        """
+        saved = self._saved
+        current = [self.header.raw_fields]
+        current.extend(record.raw_fields for record in self.records)
+
+        keep = 0
+        if saved is not None and saved.keys is keys and saved.init_vec == self.f_iv:
+            for (raw_fields, (fields, dummy)) in zip(current, saved.segments):
+                if not _unchanged(raw_fields, fields):
+                    break
+                keep += 1
+        header = self.header
+        if (keep == 0 or 0x04 not in header.raw_fields or 0x06 not in header.raw_fields
+                or header.last_save_what != _LAST_SAVE_WHAT
+                or time.time() - header.last_save >= _HEADER_STAMP_INTERVAL):
+            # also when the header lacks a stamp of ours, e.g. last saved by another program
+            header.last_save = int(time.time())
+            header.last_save_what = _LAST_SAVE_WHAT
+            keep = 0
+
+        if keep:
+            start = saved.segments[keep - 1][1]
+            segments = saved.segments[:keep]
+        else:
+            start = 0
+            segments = []
 
-        _write_field_tlv(filehandle, cipher, None)
+        end_of_record = Field(0xff, b"")
 
+        fields = []
+        end = start
+        for raw_fields in current[keep:]:
+            values = tuple(raw_fields.values())
+            fields.extend(values)
+            fields.append(end_of_record)
+            for field in values:
+                end += (5 + len(field.raw_value) + 15) & ~15
+            end += 16
+            segments.append((values, end))
+
+        hmac_checker = keys.hmac()
+        for raw_fields in current:
+            for field in raw_fields.values():
+                hmac_checker.update(field.raw_value)
         self.f_hmac = hmac_checker.digest()
-        filehandle.write(self.f_hmac)
 
-    def write_to_file(self, filename, password: bytes):
+        if start:
+            cipher = keys.cbc(saved.ciphertext[start - 16:start])
+            ciphertext = saved.ciphertext[:start] + cipher.encrypt(_pack_field_tlvs(fields))
+        else:
+            ciphertext = keys.cbc(self.f_iv).encrypt(_pack_field_tlvs(fields))
+        self._saved = _SavedStream(keys, self.f_iv, ciphertext, segments)
+
+        # write the whole file at once
+
+        filehandle.write(b"".join((
+            self._preamble(),
+            ciphertext,
+            _EOF_MARKER,
+            self.f_hmac,
+        )))
+        return start
+
+    def _verify_stream(self, filehandle, keys, start=0):
+        """
+        Check that the given file handle holds what was just written, using the keys of the write.
+
+        Encrypted fields before offset start were re-used from the previous read or write and
+        are compared as they are, the rest is decrypted again.  Raises VaultFormatError if the
+        preamble differs, the fields are not properly framed, or their HMAC does not match the
+        one computed during the write.
+        """
+        preamble = self._preamble()
+        if filehandle.read(len(preamble)) != preamble:
+            raise VaultFormatError("File integrity check failed")
+        (ciphertext, f_hmac) = _split_body(filehandle.read())
+        if f_hmac != self.f_hmac:
+            raise VaultFormatError("File integrity check failed")
+
+        saved = self._saved
+        if ciphertext[:start] != saved.ciphertext[:start]:
+            raise VaultFormatError("File integrity check failed")
+        init_vec = ciphertext[start - 16:start] if start else self.f_iv
+        plaintext = keys.cbc(init_vec).decrypt(ciphertext[start:])
+
+        hmac_checker = keys.hmac()
+        # the re-used segments are exactly those ending up to start
+        for (fields, end) in saved.segments:
+            if end > start:
+                break
+            for field in fields:
+                hmac_checker.update(field.raw_value)
+        for (field, dummy) in _iter_field_tlvs(plaintext):
+            hmac_checker.update(field.raw_value)
+        if hmac_checker.digest() != self.f_hmac:
+            raise VaultFormatError("File integrity check failed")
+
+    def write_to_file(self, filename, password: bytes, full_verify=False, iterations=None,
+                      iterations_tolerance=0.25):
         """
         Store contents of this Vault into a file.
+
+        If iterations is given and differs from the current ITER by more than the given fraction
+        of the latter, the password is re-stretched accordingly first, see set_iterations().  The
+        tolerance keeps calibrated numbers of iterations, which vary from one measurement to the
+        next, from causing a re-stretch (and re-encryption of everything) on every save.
+
+        The written file is checked before it replaces the original one.  By default, this
+        re-uses the keys used for writing; with full_verify, the file is opened as a new
+        Vault instead, which means stretching the password again and parsing every record.
         """
+        if iterations:
+            iterations = max(MIN_ITERATIONS, iterations)
+            if abs(iterations - self.f_iter) > self.f_iter * iterations_tolerance:
+                self.set_iterations(password, iterations)
+        keys = self._get_keys(password)
 
         # write to temporary file first
         (osfilehandle, tmpfilename) = tempfile.mkstemp(
             '.part', os.path.basename(filename) + ".", os.path.dirname(filename), text=False)
         #filehandle = os.fdopen(osfilehandle, "wb")
         with open(osfilehandle, 'wb') as filehandle:
-            self.write_to_stream(filehandle, password)
+            start = self._write_to_stream(filehandle, keys)
         #filehandle.close()
 
         try:
-            _ = Vault(password, filename=tmpfilename)
+            if full_verify:
+                Vault(password, filename=tmpfilename).close()
+            else:
+                with open(tmpfilename, 'rb') as filehandle:
+                    self._verify_stream(filehandle, keys, start)
         except RuntimeError as e:
             os.remove(tmpfilename)
+            self._saved = None
             raise VaultFormatError("File integrity check failed") from e
 
         # after writing the temporary file, replace the original file with it
@@ -508,3 +1213,4 @@ class Vault:
         except OSError:
             pass
         os.rename(tmpfilename, filename)
+        self.journal.clear()